@@ -3,20 +3,11 @@ import random
 import numpy as np
 from obstacle import Obstacle
 from subgoals import find_subgoal
+from scenario import Scenario, DEFAULT_SCENARIO
 from constants import (
     AGENT_AVG_SPEED,
-    AGENT_RADIUS,
-    EXITS,
     AGENT_COLOR,
-    AGENT_COUNT,
-    ENV_LENGTH,
-    BOX_LEFT,
-    BOX_HEIGHT,
-    BOX_TOP,
-    BOX_WIDTH,
     AGENT_SPEED_SIGMA,
-    SUBGOAL_N,
-    SEPARATION_THRESHOLD,
 )
 
 
@@ -32,21 +23,32 @@ def normalize_non_zero(vector):
 
 
 class Agent:
-    def __init__(self, x, y, id, avg_speed=AGENT_AVG_SPEED, sigma=AGENT_SPEED_SIGMA):
+    def __init__(self, x, y, id, avg_speed=AGENT_AVG_SPEED, sigma=AGENT_SPEED_SIGMA, scenario:Scenario=DEFAULT_SCENARIO,
+                 velocity=None, speed_quantile=None):
+        """
+        velocity and speed_quantile (in [0, 1), the position of max_speed within avg_speed +- avg_speed*sigma)
+        are drawn from the global random generators if not given.
+        """
+        self.scenario = scenario
+        self.radius = scenario.agent_radius
         self.position = pygame.Vector2(x, y)
-        self.velocity = pygame.Vector2(random.uniform(-1, 1), random.uniform(-1, 1))
+        if velocity is None:
+            velocity = (random.uniform(-1, 1), random.uniform(-1, 1))
+        self.velocity = pygame.Vector2(velocity)
         self.acceleration = pygame.Vector2(0, 0)
-        self.max_speed = np.random.uniform(avg_speed - avg_speed*sigma, avg_speed + avg_speed*sigma)
-        self.avoid_distance = 2 * AGENT_RADIUS + 2
-        self.cohesion_distance = 8 * AGENT_RADIUS
-        self.alignment_distance = 4 * AGENT_RADIUS
+        if speed_quantile is None:
+            self.max_speed = np.random.uniform(avg_speed - avg_speed*sigma, avg_speed + avg_speed*sigma)
+        else:
+            self.max_speed = avg_speed - avg_speed*sigma + 2*avg_speed*sigma*speed_quantile
+        self.avoid_distance = 2 * self.radius + 2
+        self.cohesion_distance = 8 * self.radius
+        self.alignment_distance = 4 * self.radius
         self.perception = max(self.avoid_distance, self.alignment_distance,
-                              self.cohesion_distance)  # perception required for the record distances function
+                              self.cohesion_distance)  # perception required for the neighborhood of a tick
         self.id = id
-        self.distances = np.full(AGENT_COUNT, fill_value=-1)  # distance of agents around
         self.color = AGENT_COLOR
         self.panic = 0
-        self.ease_distance = AGENT_RADIUS * 10
+        self.ease_distance = self.radius * 10
         self.avg_panic_around = 0
         self.in_exit_area = False
         self.highlight = False
@@ -73,13 +75,14 @@ class Agent:
         self.acceleration *= 0
         self.calculate_exit_distances()
 
-    def flock(self, agents, obstacles, sep_threshold):
+    def flock(self, neighborhood, obstacles, sep_threshold):
         """
         Apply flocking behaviors with a bias towards the exit.
         """
-        alignment, align_panic = self.align(agents)
-        cohesion, physical_panic = self.cohere(agents)
-        separation = self.separate(agents, sep_threshold)
+        row = neighborhood.rows[self.id]
+        alignment, align_panic = self.align(neighborhood, row)
+        cohesion, physical_panic = self.cohere(neighborhood, row)
+        separation = self.separate(neighborhood, row, sep_threshold)
         exit_steering, exit_panic = self.steer_to_exit()
         avoid_obstacles = self.avoid_obstacles(obstacles)
 
@@ -107,21 +110,16 @@ class Agent:
         if min(self.exit_distances) < self.cohesion_distance:
             self.apply_force(exit_steering)
 
-    def align(self, agents):
+    def align(self, neighborhood, row):
         '''
         An agent tries to align its velocity vector with the ones
         around it within self.alignment_distance
         '''
-        total = 0
+        total = neighborhood.count(self.alignment_distance)[row]
         steering = pygame.Vector2(0, 0)
         panic_component = 0
-        for other in agents:
-            distance = self.distances[other.id]
-            if other != self and distance < self.alignment_distance and distance != -1:
-                steering += other.velocity
-                total += 1
         if total > 0:
-            steering /= total
+            steering = pygame.Vector2(*neighborhood.mean_velocity(self.alignment_distance)[row])
             panic_component = 1 / self.max_speed * (steering.length() - self.velocity.length())
             steering -= self.velocity
             steering = normalize_non_zero(steering)
@@ -129,28 +127,18 @@ class Agent:
 
         return steering, panic_component
 
-    def cohere(self, agents):
+    def cohere(self, neighborhood, row):
         '''
         Agents try to move tovards the average position of agents within
         self.cohesion_distance
         '''
-        total = 0
-        close_neighbors = 0
+        total = neighborhood.count(self.cohesion_distance)[row]
+        close_neighbors = neighborhood.count(self.radius * 3)[row]
         steering = pygame.Vector2(0, 0)
-        others_panic = 0
         panic_component = 0
-        for other in agents:
-            distance = self.distances[other.id]
-            if other != self and distance < self.cohesion_distance and distance != -1:
-                steering += other.position
-                others_panic += other.panic
-                total += 1
-            if other != self and distance < AGENT_RADIUS * 3 and distance != -1:
-                close_neighbors += 1
         if total > 0:
-            others_panic /= total
-            self.avg_panic_around = others_panic
-            steering /= total
+            self.avg_panic_around = float(neighborhood.mean_panic(self.cohesion_distance)[row])
+            steering = pygame.Vector2(*neighborhood.mean_position(self.cohesion_distance)[row])
             steering -= self.position
             steering = normalize_non_zero(steering)
             steering *= 1.5
@@ -163,24 +151,17 @@ class Agent:
         
         return steering, panic_component
 
-    def separate(self, agents, sep_threshold):
+    def separate(self, neighborhood, row, sep_threshold):
         '''
         Agents try to separate themself from nearby agents within
         self.avoid_distance
         '''
-        total = 0
+        total = neighborhood.count(self.avoid_distance)[row]
         steering = pygame.Vector2(0, 0)
-        weight = 2.5
-        for other in agents:
-            distance = self.distances[other.id]
-            if other != self and distance < self.avoid_distance and distance != -1:
-                diff = self.position - other.position
-                diff /= (self.avoid_distance - distance) + 0.00000000001
-                steering += diff
-                total += 1
-            if distance < AGENT_RADIUS * sep_threshold and distance != -1:
-                weight *= 5
+        # Every agent closer than the separation threshold makes separation 5 times stronger
+        weight = 2.5 * 5 ** int(neighborhood.count(self.radius * sep_threshold)[row])
         if total > 0:
+            steering = pygame.Vector2(*neighborhood.separation(self.avoid_distance)[row])
             steering /= total
             steering = normalize_non_zero(steering)
             steering *= weight
@@ -189,27 +170,29 @@ class Agent:
 
     def steer_to_exit(self):
         '''
-        Agents choose a subgoal based on their position and try to steer towards it
+        Agents choose a subgoal based on their position and try to steer towards it,
+        or follow the flow field of the scenario if it navigates with one
         '''
         self.calculate_exit_distances()
-        if self.subgoal_indicator >= SUBGOAL_N:
+        if self.scenario.navigation == "flow_field":
+            # Follow the shortest path around the obstacles to the nearest exit
+            target = self.position + self.scenario.flow_field.steering_at(self.position)
+        elif self.subgoal_indicator >= self.scenario.subgoal_n:
             # Find the nearest exit
             min_distance = float('inf')
             target = None
 
-            for exit in EXITS:
-                exit_position = pygame.Vector2(exit["position"][0] + exit["width"] / 2,
-                                               exit["position"][1] + exit["height"] / 2)
+            for exit_position in self.scenario.exit_targets:
                 distance_to_exit = self.position.distance_to(exit_position)
                 if distance_to_exit < min_distance:
                     min_distance = distance_to_exit
                     target = exit_position
         else:
-            target, in_goal = find_subgoal(self.subgoal_indicator, self.position)
+            target, in_goal = find_subgoal(self.subgoal_indicator, self.position, self.scenario)
             if in_goal:
                 self.subgoal_indicator += 1
         steering = target - self.position
-        panic_component = 1 / ENV_LENGTH * (steering.length() - self.ease_distance)
+        panic_component = 1 / self.scenario.env_length * (steering.length() - self.ease_distance)
         
         steering = normalize_non_zero(steering)
         steering *= 6.5
@@ -245,10 +228,11 @@ class Agent:
         Agents try to steer away from bordering walls.
         '''
         # Calculate distances to each wall
-        left = self.position[0] - BOX_LEFT
-        right = BOX_LEFT + BOX_WIDTH - self.position[0]
-        top = self.position[1] - BOX_TOP
-        bottom = BOX_TOP + BOX_HEIGHT - self.position[1]
+        scenario = self.scenario
+        left = self.position[0] - scenario.box_left
+        right = scenario.box_left + scenario.box_width - self.position[0]
+        top = self.position[1] - scenario.box_top
+        bottom = scenario.box_top + scenario.box_height - self.position[1]
         distances = [left, right, top, bottom]
 
         steering = pygame.Vector2(0, 0)
@@ -283,8 +267,8 @@ class Agent:
         Draw agent on screen.
         """
         if self.highlight:
-            pygame.draw.circle(screen, (0, 255, 0), (int(self.position.x), int(self.position.y)), AGENT_RADIUS + 2)
-        pygame.draw.circle(screen, self.color, (int(self.position.x), int(self.position.y)), AGENT_RADIUS)
+            pygame.draw.circle(screen, (0, 255, 0), (int(self.position.x), int(self.position.y)), self.radius + 2)
+        pygame.draw.circle(screen, self.color, (int(self.position.x), int(self.position.y)), self.radius)
 
     def calculate_exit_distances(self):
         """
@@ -292,6 +276,4 @@ class Agent:
 
         :return: None
         """
-        exit_vectors = [pygame.Vector2(e["position"][0] - e["width"] // 2, e["position"][1] - e["height"] // 2) for e in
-                        EXITS]
-        self.exit_distances = [self.position.distance_to(center) for center in exit_vectors]
\ No newline at end of file
+        self.exit_distances = [self.position.distance_to(center) for center in self.scenario.exit_reference_points]
\ No newline at end of file
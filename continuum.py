@@ -0,0 +1,202 @@
+import math
+from collections import deque
+import numpy as np
+from navigation import FlowField, NEIGHBOURS
+from scenario import Scenario
+from subgoals import find_subgoal
+
+# Cell side length in agent radii, and the density bounds as fractions of the jam density
+LOD_CELL_RADII = 6
+ABSORB_DENSITY = 0.6
+RELEASE_DENSITY = 0.3
+# Distance between agents in a jam in agent radii, the separation of the boids lets them overlap
+JAM_SPACING_RADII = 1.5
+# Fraction of the free speed a jammed cell still moves at, the boids crowd is compressible and never stops
+MIN_SPEED_FRACTION = 0.1
+# Cells this many cells or less from an exit always simulate agents one by one
+EXIT_ZONE_CELLS = 2
+# Neighbors within 3 radii of an agent that make a physical panic of 1, the normalization of `Agent.cohere`
+CLOSE_NEIGHBORS_NORM = 6
+# Alignment panic of an agent in a crowd per unit of physical panic: the velocities of jammed agents point
+# in different directions, so their mean is shorter than their speeds. Fitted to the default hall.
+ALIGN_PANIC_PER_PHYSICAL = -0.3
+
+
+class Continuum:
+    """
+    Coarse level of detail for dense crowds, a cell transmission model on a grid over the hall.
+
+    Agents in cells whose density reaches absorb_density are taken out of the agent-based simulation
+    and held by their cell. Every tick each cell sends agents to the neighbouring cell on the shortest
+    path to an exit, at the speed of the Greenshields fundamental diagram v = v_free * (1 - density / jam),
+    but at least `MIN_SPEED_FRACTION` of v_free, and never more agents than the receiving cell has room
+    for. Once the density of a cell drops below
+    release_density, or agents reach the cells in front of an exit, its agents are released again as
+    `Agent`s spread over the cell.
+
+    The continuum keeps the Agent objects it holds, in first-in first-out order per cell, so every agent
+    keeps its id and speed and can only escape after it was released. The metrics therefore count every
+    agent and every escape exactly as without the continuum. The panic of the held agents follows the
+    update of `Agent.flock` with the terms a cell can give: the physical panic from the density of the
+    cell, the exit panic from the distance of the cell to the nearest exit, and an alignment panic
+    proportional to the physical one, see `ALIGN_PANIC_PER_PHYSICAL`. Agents at a panic of 0.5 or more
+    herd and take the mean panic of their cell.
+    """
+    def __init__(self, scenario:Scenario, absorb_density:float=ABSORB_DENSITY, release_density:float=RELEASE_DENSITY,
+                 cell_size:float=None) -> None:
+        """
+        Parameters:
+            scenario (Scenario): The hall and crowd.
+            absorb_density (float): Density, as a fraction of the jam density, from which a cell is coarse.
+            release_density (float): Density below which a coarse cell releases its agents, below absorb_density.
+            cell_size (float): Side length of a cell, defaults to `LOD_CELL_RADII` agent radii.
+        """
+        if not 0 < release_density < absorb_density <= 1:
+            raise ValueError(f"Invalid densities: release_density ({release_density}) must be below absorb_density ({absorb_density}), both in (0, 1].")
+        radius = scenario.agent_radius
+        if cell_size is None:
+            cell_size = LOD_CELL_RADII * radius
+        self.scenario = scenario
+        self.field = FlowField.from_scenario(scenario, cell_size)
+        self.cell_size = cell_size
+        self.shape = self.field.distance.shape
+        rows, columns = self.shape
+        self.jam = (cell_size / (JAM_SPACING_RADII * radius)) ** 2
+        self.absorb_count = absorb_density * self.jam
+        self.release_count = release_density * self.jam
+
+        # Neighbouring cell every cell sends its agents to, -1 for the cells in front of the exits
+        padded = np.pad(self.field.distance, 1, constant_values=np.inf)
+        neighbour_distances = np.stack([padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + columns] for dr, dc in NEIGHBOURS])
+        best = np.argmin(neighbour_distances, axis=0)
+        offsets = np.array(NEIGHBOURS)[best]
+        grid_row, grid_column = np.indices(self.shape)
+        self.downstream = ((grid_row + offsets[..., 0]) * columns + grid_column + offsets[..., 1]).ravel()
+        self.step_length = (cell_size * np.hypot(offsets[..., 0], offsets[..., 1])).ravel()
+        self.downstream[(np.min(neighbour_distances, axis=0) >= self.field.distance).ravel()] = -1
+
+        # Cells near the exits, where escapes are decided agent by agent
+        exit_distance = np.full(self.shape, np.inf)
+        center_x = scenario.box_left + (np.arange(columns) + 0.5) * cell_size
+        center_y = scenario.box_top + (np.arange(rows) + 0.5) * cell_size
+        grid_x, grid_y = np.meshgrid(center_x, center_y)
+        for target in scenario.exit_targets:
+            exit_distance = np.minimum(exit_distance, np.hypot(grid_x - target.x, grid_y - target.y))
+        self.exit_zone = (exit_distance <= (EXIT_ZONE_CELLS + 1) * cell_size).ravel() | (self.downstream < 0)
+        self.exit_distance = exit_distance.ravel()
+        self.centers = np.stack((grid_x.ravel(), grid_y.ravel()), axis=1)
+
+        self.members = [deque() for _ in range(rows * columns)]
+        self.count = np.zeros(rows * columns, dtype=int)
+        # Fraction of an agent every cell has sent but not yet moved
+        self.carry = np.zeros(rows * columns)
+
+    def __len__(self) -> int:
+        return int(self.count.sum())
+
+    def agents(self) -> list:
+        """Returns the agents held by the continuum."""
+        return [agent for members in self.members for agent in members]
+
+    def cells_of(self, agents:list) -> np.ndarray:
+        row, column = self.field.cell_of([(agent.position.x, agent.position.y) for agent in agents])
+        return row * self.shape[1] + column
+
+    def step(self, agents:list) -> list:
+        """
+        Absorbs the agents in dense cells, moves the coarse agents one tick along the exit paths,
+        and releases the agents of cells that became sparse.
+
+        Parameters:
+            agents (list): The agents simulated one by one.
+
+        Returns:
+            list: The agents to simulate one by one from now on.
+        """
+        total = len(agents) + len(self)
+        cells = self.cells_of(agents) if agents else np.empty(0, dtype=int)
+        discrete_count = np.bincount(cells, minlength=len(self.count))
+
+        # Absorb the agents of dense cells
+        dense = (discrete_count + self.count >= self.absorb_count) & ~self.exit_zone
+        absorbed = dense[cells]
+        for agent, cell in zip(agents, cells):
+            if dense[cell]:
+                self.members[cell].append(agent)
+        np.add.at(self.count, cells[absorbed], 1)
+        agents = [agent for agent, out in zip(agents, absorbed) if not out]
+        discrete_count -= np.bincount(cells[absorbed], minlength=len(self.count))
+
+        occupied = discrete_count + self.count
+        self._update_panic(occupied)
+
+        # Send agents downstream, with the flows of all cells computed from the counts at the start of the tick
+        sending = np.flatnonzero((self.count > 0) & (self.downstream >= 0))
+        room = np.maximum(self.jam - occupied, 0)
+        moves = []
+        for cell in sending:
+            members = self.members[cell]
+            free_speed = sum(agent.max_speed for agent in members) / len(members)
+            speed = free_speed * max(MIN_SPEED_FRACTION, 1 - occupied[cell] / self.jam)
+            send = self.count[cell] * speed / self.step_length[cell] + self.carry[cell]
+            target = self.downstream[cell]
+            n = min(int(send), self.count[cell], int(room[target]))
+            room[target] -= n
+            self.carry[cell] = send - n if n == int(send) else 0.0
+            moves.append((cell, target, n))
+        for cell, target, n in moves:
+            for _ in range(n):
+                agent = self.members[cell].popleft()
+                agent.position.update(*self.centers[target])
+                self.members[target].append(agent)
+            self.count[cell] -= n
+            self.count[target] += n
+
+        # Release the agents of sparse cells and of the cells in front of the exits
+        release = np.flatnonzero((self.count > 0) & ((discrete_count + self.count < self.release_count) | self.exit_zone))
+        for cell in release:
+            agents.extend(self._release(cell))
+
+        assert len(agents) + len(self) == total, "The continuum lost or created agents."
+        return agents
+
+    def _update_panic(self, occupied:np.ndarray) -> None:
+        """Updates the panic of the held agents like `Agent.flock`, from the density and exit distance of their cells."""
+        radius = self.scenario.agent_radius
+        # Expected number of other agents within 3 radii at the density of the cell
+        close_neighbors = np.maximum(occupied / self.cell_size ** 2 * math.pi * (3 * radius) ** 2 - 1, 0)
+        physical_panic = close_neighbors / CLOSE_NEIGHBORS_NORM
+        crowd_panic = (1 + ALIGN_PANIC_PER_PHYSICAL) * physical_panic
+        env_length = self.scenario.env_length
+        for cell in np.flatnonzero(self.count):
+            members = self.members[cell]
+            panic_around = sum(agent.panic for agent in members) / len(members)
+            for agent in members:
+                agent.avg_panic_around = panic_around
+                exit_panic = (self.exit_distance[cell] - agent.ease_distance) / env_length
+                agent.panic = max(0, min(1, (agent.panic + (exit_panic + crowd_panic[cell]) / 3) / 2))
+                if agent.panic >= 0.5:
+                    agent.panic = panic_around
+
+    def _release(self, cell:int) -> list:
+        """Empties a cell, spreading its agents evenly over it and heading them to the exit."""
+        members = list(self.members[cell])
+        self.members[cell].clear()
+        self.count[cell] = 0
+        self.carry[cell] = 0.0
+        side = math.ceil(math.sqrt(len(members)))
+        spacing = self.cell_size / side
+        left, top = self.centers[cell] - self.cell_size / 2
+        direction = self.field.direction.reshape(-1, 2)[cell]
+        scenario = self.scenario
+        for k, agent in enumerate(members):
+            row, column = divmod(k, side)
+            agent.position.update(left + (column + 0.5) * spacing, top + (row + 0.5) * spacing)
+            agent.velocity.update(*(direction * agent.max_speed))
+            # Subgoals the agent was carried through count as reached
+            if scenario.navigation != "flow_field":
+                while agent.subgoal_indicator < scenario.subgoal_n and \
+                        find_subgoal(agent.subgoal_indicator, agent.position, scenario)[1]:
+                    agent.subgoal_indicator += 1
+            agent.calculate_exit_distances()
+        return members
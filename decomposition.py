@@ -0,0 +1,180 @@
+import threading
+import numpy as np
+from multiprocessing import Barrier, Process, Value
+from multiprocessing.shared_memory import SharedMemory
+from agent import Agent
+from neighborhood import Neighborhood
+from scenario import Scenario
+
+# Columns of the state of an agent in shared memory, the row of an agent is its id
+X, Y, VX, VY, MAX_SPEED, PANIC, AVG_PANIC_AROUND, SUBGOAL, HIGHLIGHT, COLOR, OWNER = range(11)
+FIELDS = 11
+# Owner of the rows of escaped agents
+ESCAPED = -1
+# Seconds the master waits for the workers at a barrier, and between two checks whether all workers are alive
+BARRIER_TIMEOUT = 600
+WATCH_INTERVAL = 0.5
+
+
+def _strip_worker(strip:int, shared_name:str, capacity:int, bounds:np.ndarray, axis:int, perception:float,
+                  k:int, scenario:Scenario, sep_threshold:float, start, done, stop) -> None:
+    """
+    Steps the agents of one strip every tick, between the start and done barriers of the master.
+
+    The master writes the state of all agents at the start of the tick to the first buffer. The strip
+    reads its own agents and the halo, the agents of other strips within perception of its bounds,
+    flocks its own agents and writes their new state to the second buffer. Agents that crossed into
+    the strip since the last tick are created from their row, agents that left it are dropped.
+    The worker returns when the master sets stop or breaks the barriers.
+    """
+    shared = SharedMemory(name=shared_name)
+    state, stepped = np.ndarray((2, capacity, FIELDS), dtype=float, buffer=shared.buf)
+    obstacles = scenario.obstacles
+    agents = {}
+    low, high = bounds[strip] - perception, bounds[strip + 1] + perception
+    try:
+        while True:
+            start.wait()
+            if stop.value:
+                return
+            owner = state[:, OWNER]
+            owned = np.flatnonzero(owner == strip)
+            coordinate = state[:, axis]
+            halo = np.flatnonzero((owner != strip) & (owner != ESCAPED) & (coordinate >= low) & (coordinate < high))
+            rows = np.concatenate((owned, halo))
+            neighborhood = Neighborhood.from_arrays(rows.tolist(), state[rows, X:Y + 1], state[rows, VX:VY + 1],
+                                                    state[rows, PANIC], perception, k)
+
+            owned_ids = owned.tolist()
+            for id in set(agents) - set(owned_ids):
+                del agents[id]
+            values = state[owned].tolist()
+            for id, row in zip(owned_ids, values):
+                agent = agents.get(id)
+                if agent is None:
+                    agent = agents[id] = Agent(row[X], row[Y], id, scenario=scenario, velocity=(row[VX], row[VY]), speed_quantile=0)
+                    agent.max_speed = row[MAX_SPEED]
+                agent.position.update(row[X], row[Y])
+                agent.velocity.update(row[VX], row[VY])
+                agent.panic = row[PANIC]
+                agent.avg_panic_around = row[AVG_PANIC_AROUND]
+                agent.subgoal_indicator = int(row[SUBGOAL])
+                agent.highlight = bool(row[HIGHLIGHT])
+
+            for id in owned_ids:
+                agent = agents[id]
+                agent.flock(neighborhood, obstacles, sep_threshold)
+                agent.update()
+            if owned_ids:
+                stepped[owned] = [(agent.position.x, agent.position.y, agent.velocity.x, agent.velocity.y, agent.max_speed,
+                                   agent.panic, agent.avg_panic_around, agent.subgoal_indicator, agent.highlight,
+                                   agent.color[1], strip) for agent in (agents[id] for id in owned_ids)]
+            done.wait()
+    except threading.BrokenBarrierError:
+        return
+    finally:
+        shared.close()
+
+
+class StripPool:
+    """
+    Worker processes that step a single run together, each owning the agents in one strip of the hall.
+
+    The hall is cut across its longer side into strips holding the same number of agents at the start.
+    The state of all agents lives in shared memory; every tick an agent belongs to the strip its position
+    is in, so agents that cross a boundary migrate to the neighboring worker. A worker sees the agents of
+    the other strips within perception of its bounds as halo, which are all the neighbors its agents can
+    have, so every agent is stepped with the same neighborhood as in the serial loop.
+
+    A thread of the master breaks the barriers as soon as a worker dies, so a crashed worker makes
+    `step` raise instead of waiting forever.
+    """
+    def __init__(self, scenario:Scenario, strips:int, sep_threshold:float, perception:float, k:int=None) -> None:
+        """
+        Parameters:
+            scenario (Scenario): The hall and crowd.
+            strips (int): Number of strips and worker processes.
+            sep_threshold (float): Separation threshold of the run.
+            perception (float): Largest neighbor radius of the agents.
+            k (int): Number of nearest neighbors every agent interacts with, see `Neighborhood`.
+        """
+        self.capacity = scenario.agent_count
+        self.axis = X if scenario.box_width >= scenario.box_height else Y
+        # Strip bounds at quantiles of the spawn positions, so every worker starts with as many agents
+        spawn = scenario.spawn_positions[:, self.axis]
+        inner = np.quantile(spawn, np.arange(1, strips) / strips) if strips > 1 else np.empty(0)
+        self.bounds = np.concatenate(([-np.inf], inner, [np.inf]))
+
+        self.shared = SharedMemory(create=True, size=2 * self.capacity * FIELDS * 8)
+        self.state, self.stepped = np.ndarray((2, self.capacity, FIELDS), dtype=float, buffer=self.shared.buf)
+        self.start = Barrier(strips + 1)
+        self.done = Barrier(strips + 1)
+        self.stop = Value('b', 0)
+        self.workers = [Process(target=_strip_worker, daemon=True,
+                                args=(strip, self.shared.name, self.capacity, self.bounds, self.axis, perception, k,
+                                      scenario, sep_threshold, self.start, self.done, self.stop))
+                        for strip in range(strips)]
+        for worker in self.workers:
+            worker.start()
+        self._closed = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="strip watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _watch(self) -> None:
+        while not self._closed.wait(WATCH_INTERVAL):
+            if not all(worker.is_alive() for worker in self.workers):
+                self.start.abort()
+                self.done.abort()
+                return
+
+    def _wait(self, barrier) -> None:
+        try:
+            barrier.wait(BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            dead = [strip for strip, worker in enumerate(self.workers) if not worker.is_alive()]
+            if dead:
+                raise RuntimeError(f"Strip workers {dead} died.") from None
+            raise RuntimeError(f"Strip workers did not finish a tick within {BARRIER_TIMEOUT} seconds.") from None
+
+    def step(self, agents:list) -> None:
+        """Flocks and updates the active agents in the strip workers and copies their new state back."""
+        if not agents:
+            return
+        ids = [agent.id for agent in agents]
+        state = self.state
+        state[:, OWNER] = ESCAPED
+        state[ids] = [(agent.position.x, agent.position.y, agent.velocity.x, agent.velocity.y, agent.max_speed,
+                       agent.panic, agent.avg_panic_around, agent.subgoal_indicator, agent.highlight, 0, 0)
+                      for agent in agents]
+        state[ids, OWNER] = np.searchsorted(self.bounds[1:-1], state[ids, self.axis], side='right')
+        self._wait(self.start)
+        self._wait(self.done)
+
+        for agent, row in zip(agents, self.stepped[ids].tolist()):
+            agent.position.update(row[X], row[Y])
+            agent.velocity.update(row[VX], row[VY])
+            agent.panic = row[PANIC]
+            agent.avg_panic_around = row[AVG_PANIC_AROUND]
+            agent.subgoal_indicator = int(row[SUBGOAL])
+            agent.highlight = bool(row[HIGHLIGHT])
+            agent.color = (255, row[COLOR], row[COLOR])
+
+    def close(self) -> None:
+        """Stops the workers and frees the shared memory, also after a worker died or a tick was interrupted."""
+        self._closed.set()
+        self.stop.value = 1
+        if not self.start.broken:
+            try:
+                self.start.wait(WATCH_INTERVAL)
+            except threading.BrokenBarrierError:
+                pass
+        # Workers still waiting at a barrier return once it is broken
+        self.start.abort()
+        self.done.abort()
+        for worker in self.workers:
+            worker.join(WATCH_INTERVAL)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self.shared.close()
+        self.shared.unlink()
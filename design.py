@@ -0,0 +1,94 @@
+import itertools
+import numpy as np
+from scipy.stats import qmc
+from constants import AGENT_AVG_SPEED, AGENT_SPEED_SIGMA, SEPARATION_THRESHOLD
+
+# Parameters of a design point, in the order of `Simulation.main_loop`
+PARAMETERS = ("avg_speed", "sigma", "sep_threshold")
+DESIGN_METHODS = ("lhs", "sobol")
+# Values of the parameters that are not in a design, the defaults of `Simulation.main_loop`
+PARAMETER_DEFAULTS = {"avg_speed": AGENT_AVG_SPEED, "sigma": AGENT_SPEED_SIGMA, "sep_threshold": SEPARATION_THRESHOLD}
+
+
+def factorial_design(avg_speeds:list, sigmas:list, sep_thresholds:list) -> list:
+    """
+    Returns every combination of the given values as (avg_speed, sigma, sep_threshold) points.
+    """
+    return list(itertools.product(avg_speeds, sigmas, sep_thresholds))
+
+
+def space_filling_design(ranges:dict, n:int, method:str="lhs", seed:int=0) -> list:
+    """
+    Samples n points that spread evenly over continuous ranges of the parameters.
+
+    Parameters:
+        ranges (dict): (low, high) per name of `PARAMETERS`, or a single value to hold a parameter fixed.
+            Parameters that are left out are held at `PARAMETER_DEFAULTS`.
+        n (int): Number of points, a power of 2 for 'sobol'.
+        method (str): 'lhs' for a Latin hypercube or 'sobol' for a scrambled Sobol sequence.
+        seed (int): Seed of the sampler.
+
+    Returns:
+        list: (avg_speed, sigma, sep_threshold) per point.
+    """
+    if method not in DESIGN_METHODS:
+        raise ValueError(f"Invalid design method: {method}. Must be one of {DESIGN_METHODS}.")
+    for name in ranges:
+        if name not in PARAMETERS:
+            raise ValueError(f"Invalid parameter: {name}. Must be one of {PARAMETERS}.")
+    if n < 1:
+        raise ValueError(f"Invalid n: {n}. A design needs at least one point.")
+    varied = [name for name in PARAMETERS if np.ndim(ranges.get(name)) == 1]
+    if not varied:
+        raise ValueError(f"Invalid ranges: {ranges}. At least one parameter needs a (low, high) range.")
+    fixed = {name: ranges.get(name, PARAMETER_DEFAULTS[name]) for name in PARAMETERS if name not in varied}
+    if method == "lhs":
+        unit = qmc.LatinHypercube(d=len(varied), seed=seed).random(n)
+    else:
+        if n & (n - 1) != 0:
+            raise ValueError(f"Invalid n: {n}. A Sobol design needs a power of 2 points.")
+        unit = qmc.Sobol(d=len(varied), seed=seed).random_base2(int(np.log2(n)))
+    low = [ranges[name][0] for name in varied]
+    high = [ranges[name][1] for name in varied]
+    samples = qmc.scale(unit, low, high)
+
+    points = []
+    for sample in samples:
+        values = {**fixed, **dict(zip(varied, sample.tolist()))}
+        points.append(tuple(values[name] for name in PARAMETERS))
+    return points
+
+
+def _quadratic_features(points:np.ndarray) -> np.ndarray:
+    """Constant, linear, interaction and squared terms of the parameters."""
+    points = np.atleast_2d(points)
+    columns = [np.ones(len(points))]
+    columns += [points[:, i] for i in range(points.shape[1])]
+    columns += [points[:, i] * points[:, j] for i, j in itertools.combinations_with_replacement(range(points.shape[1]), 2)]
+    return np.column_stack(columns)
+
+
+class ResponseSurface:
+    """
+    Quadratic least-squares fit of an outcome over the parameters, to interpolate between the points of a design.
+    """
+    def __init__(self, points:list, values:list) -> None:
+        """
+        Parameters:
+            points (list): (avg_speed, sigma, sep_threshold) per run.
+            values (list): Outcome of every run, e.g. its avg_evac_time.
+        """
+        points = np.asarray(points, dtype=float)
+        # Parameters that are the same in every run carry no information
+        self.varied = np.flatnonzero(points.std(axis=0) > 0)
+        features = _quadratic_features(points[:, self.varied])
+        if len(points) < features.shape[1]:
+            raise ValueError(f"Invalid number of runs: {len(points)}. The fit needs at least {features.shape[1]}.")
+        self.coefficients, *_ = np.linalg.lstsq(features, np.asarray(values, dtype=float), rcond=None)
+        residuals = np.asarray(values, dtype=float) - features @ self.coefficients
+        self.r_squared = 1 - residuals.var() / np.var(values) if np.var(values) > 0 else 1.0
+
+    def predict(self, points:list) -> np.ndarray:
+        """Returns the fitted outcome at (avg_speed, sigma, sep_threshold) points."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        return _quadratic_features(points[:, self.varied]) @ self.coefficients
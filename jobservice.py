@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import numbers
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from scenario import DEFAULT_SCENARIO
+from sweep import replicate
+from venue import venue_for
+
+SOCKET_PATH = "cache/jobs.sock"
+STATE_FILE = "cache/jobs.json"
+JOB_STATES = ("queued", "running", "done", "cancelled", "failed")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def validate_spec(spec:dict) -> None:
+    """Raises ValueError if spec is not a valid specification of a `Job`."""
+    if not isinstance(spec, dict):
+        raise ValueError(f"Invalid sweep: {spec}. It must be an object.")
+    combinations = spec.get("combinations")
+    if not combinations or not isinstance(combinations, list):
+        raise ValueError("Invalid sweep: it has no combinations.")
+    for combination in combinations:
+        if not isinstance(combination, list) or len(combination) != 3 or not all(_is_number(value) for value in combination):
+            raise ValueError(f"Invalid combination: {combination}. It must be [avg_speed, sigma, sep_threshold].")
+    for name in ("replicas", "max_ticks"):
+        value = spec.get(name)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise ValueError(f"Invalid {name}: {value}. It must be a positive integer.")
+    if not _is_number(spec.get("priority", 0)):
+        raise ValueError(f"Invalid priority: {spec['priority']}. It must be a number.")
+    if not isinstance(spec.get("venue"), (dict, type(None))):
+        raise ValueError(f"Invalid venue: {spec['venue']}. It must be an object or null.")
+
+
+class Job:
+    """
+    A sweep submitted to the service: every combination is run with the seeds 0 to replicas - 1.
+
+    The specification is a dict with the keys
+        combinations: list of (avg_speed, sigma, sep_threshold),
+        replicas: runs per combination (default 1),
+        max_ticks: maximal number of ticks of a run (default None),
+        priority: lower numbers are run first (default 0),
+        venue: arguments of `venue_for` to run in a generated venue instead of the lecture hall (default None).
+    """
+    def __init__(self, id:int, spec:dict, state:str="queued", results:dict=None) -> None:
+        self.id = id
+        self.spec = spec
+        self.state = state
+        # Results by index of the run, see `runs`
+        self.results = results or {}
+        self.listeners = []
+        self.running = 0
+
+    @property
+    def priority(self) -> int:
+        return self.spec.get("priority", 0)
+
+    def runs(self) -> list:
+        """Returns (avg_speed, sigma, sep_threshold, seed) per run of the job."""
+        return [(*combination, seed) for combination in self.spec["combinations"]
+                for seed in range(self.spec.get("replicas", 1))]
+
+    def scenario(self):
+        venue = self.spec.get("venue")
+        return DEFAULT_SCENARIO if venue is None else venue_for(**venue)
+
+    def status(self) -> dict:
+        return {"job": self.id, "state": self.state, "priority": self.priority,
+                "done": len(self.results), "total": len(self.runs())}
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "spec": self.spec, "state": self.state,
+                "results": {str(index): result for index, result in self.results.items()}}
+
+    @classmethod
+    def from_json(cls, data:dict) -> "Job":
+        return cls(data["id"], data["spec"], data["state"], {int(index): result for index, result in data["results"].items()})
+
+
+class JobService:
+    """
+    Queues sweeps of several clients and runs their simulations in a pool of worker processes.
+
+    Runs are scheduled by the priority of their job, then in the order the jobs were submitted, with at most
+    max_concurrency runs at a time. Clients talk to the service with one JSON object per line:
+        {"op": "submit", "spec": {...}} returns {"job": id},
+        {"op": "cancel", "job": id} drops the runs of a job that did not start yet,
+        {"op": "status"} returns the status of every job,
+        {"op": "watch", "job": id} streams a {"event": "result", ...} line per finished run
+            and a {"event": "progress", ...} line after it, until the job ends.
+    The jobs and the results of their finished runs are saved to state_file after every change, and jobs
+    that did not finish are queued again when the service restarts.
+    """
+    def __init__(self, state_file:str=STATE_FILE, max_concurrency:int=None, use_cache:bool=True) -> None:
+        """
+        Parameters:
+            state_file (str): File the queue is persisted in.
+            max_concurrency (int): Maximal number of runs at a time, defaults to the number of CPUs.
+            use_cache (bool): Read and store the runs in the run cache.
+        """
+        self.state_file = state_file
+        self.max_concurrency = max_concurrency or os.cpu_count()
+        self.use_cache = use_cache
+        self.jobs = {}
+        self.queue = None
+        self.load()
+
+    def load(self) -> None:
+        """Reads the jobs of a previous session from the state file."""
+        try:
+            with open(self.state_file) as file:
+                jobs = json.load(file)
+        except FileNotFoundError:
+            return
+        for data in jobs:
+            job = Job.from_json(data)
+            if job.state == "running":
+                job.state = "queued"
+            try:
+                validate_spec(job.spec)
+            except ValueError:
+                # Saved by an older version that did not validate, it could never run
+                job.state = "failed"
+            self.jobs[job.id] = job
+
+    def save(self) -> None:
+        """Writes the jobs to the state file, atomically so a crash never leaves half a file."""
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        temporary_path = f"{self.state_file}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump([job.to_json() for job in self.jobs.values()], file)
+        os.replace(temporary_path, self.state_file)
+
+    def enqueue(self, job:Job) -> None:
+        for index in range(len(job.runs())):
+            if index not in job.results:
+                self.queue.put_nowait((job.priority, job.id, index))
+
+    def submit(self, spec:dict) -> Job:
+        validate_spec(spec)
+        job = Job(max(self.jobs, default=-1) + 1, spec)
+        self.enqueue(job)
+        self.jobs[job.id] = job
+        self.save()
+        return job
+
+    def cancel(self, job:Job) -> None:
+        if job.state in ("queued", "running"):
+            job.state = "cancelled"
+            self.save()
+            self.notify(job, {"event": "cancelled", **job.status()})
+
+    def notify(self, job:Job, message:dict) -> None:
+        for listener in job.listeners:
+            listener.put_nowait(message)
+
+    async def _run(self, executor:ProcessPoolExecutor, job:Job, index:int) -> None:
+        if job.state in ("cancelled", "failed"):
+            return
+        job.state = "running"
+        job.running += 1
+        try:
+            avg_speed, sigma, sep_threshold, seed = job.runs()[index]
+            result = await asyncio.get_running_loop().run_in_executor(
+                executor, replicate, avg_speed, sigma, sep_threshold, job.scenario(), seed,
+                job.spec.get("max_ticks"), self.use_cache)
+        except Exception as error:
+            job.state = "failed"
+            self.save()
+            self.notify(job, {"event": "failed", "error": repr(error), **job.status()})
+            return
+        finally:
+            job.running -= 1
+        if job.state in ("cancelled", "failed"):
+            return
+        job.results[index] = result
+        if len(job.results) == len(job.runs()):
+            job.state = "done"
+        elif job.running == 0:
+            job.state = "queued"
+        self.save()
+        self.notify(job, {"event": "result", "job": job.id, "run": index, "seed": seed, **result})
+        self.notify(job, {"event": "progress", **job.status()})
+        if job.state == "done":
+            self.notify(job, {"event": "done", **job.status()})
+
+    async def schedule(self) -> None:
+        """Starts the queued runs in the worker pool, never more than max_concurrency at a time."""
+        slots = asyncio.Semaphore(self.max_concurrency)
+        tasks = set()
+
+        def release(task):
+            tasks.discard(task)
+            slots.release()
+
+        with ProcessPoolExecutor(self.max_concurrency) as executor:
+            while True:
+                await slots.acquire()
+                _, job_id, index = await self.queue.get()
+                job = self.jobs[job_id]
+                if job.state in ("cancelled", "failed") or index in job.results:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._run(executor, job, index))
+                tasks.add(task)
+                task.add_done_callback(release)
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        """Answers the requests of one client connection."""
+        async def send(message):
+            writer.write((json.dumps(message) + "\n").encode())
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    op = request.get("op")
+                    if op == "submit":
+                        await send({"job": self.submit(request["spec"]).id})
+                    elif op == "status":
+                        await send({"jobs": [job.status() for job in self.jobs.values()]})
+                    elif op in ("cancel", "watch"):
+                        job = self.jobs[request["job"]]
+                        if op == "cancel":
+                            self.cancel(job)
+                            await send(job.status())
+                        else:
+                            await self.watch(job, send)
+                    else:
+                        await send({"error": f"Invalid op: {op}."})
+                except (ValueError, KeyError, TypeError) as error:
+                    await send({"error": repr(error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self, job:Job, send) -> None:
+        """Sends the results a job already has, then every new one until the job ends."""
+        listener = asyncio.Queue()
+        job.listeners.append(listener)
+        try:
+            for index, result in sorted(job.results.items()):
+                await send({"event": "result", "job": job.id, "run": index, "seed": job.runs()[index][3], **result})
+            await send({"event": "progress", **job.status()})
+            if job.state in ("done", "cancelled", "failed"):
+                await send({"event": job.state, **job.status()})
+                return
+            while True:
+                message = await listener.get()
+                await send(message)
+                if message["event"] in ("done", "cancelled", "failed"):
+                    return
+        finally:
+            job.listeners.remove(listener)
+
+    async def serve(self, socket_path:str=SOCKET_PATH, port:int=None) -> None:
+        """
+        Serves clients on a Unix socket, or on a localhost TCP port if port is given.
+        """
+        self.queue = asyncio.PriorityQueue()
+        for job in self.jobs.values():
+            if job.state == "queued":
+                self.enqueue(job)
+        if port is None:
+            os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, host="127.0.0.1", port=port)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.schedule())
+
+
+class JobClient:
+    """Blocking client of a `JobService`."""
+    def __init__(self, socket_path:str=SOCKET_PATH, port:int=None) -> None:
+        if port is None:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.connect(socket_path)
+        else:
+            self.connection = socket.create_connection(("127.0.0.1", port))
+        self.file = self.connection.makefile('rw')
+
+    def _request(self, request:dict) -> dict:
+        self.file.write(json.dumps(request) + "\n")
+        self.file.flush()
+        return self._receive()
+
+    def _receive(self) -> dict:
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The job service closed the connection.")
+        message = json.loads(line)
+        if "error" in message:
+            raise ValueError(message["error"])
+        return message
+
+    def submit(self, combinations:list, replicas:int=1, max_ticks:int=None, priority:int=0, venue:dict=None) -> int:
+        """Queues a sweep and returns the id of its job, see `Job` for the parameters."""
+        spec = {"combinations": [list(combination) for combination in combinations], "replicas": replicas,
+                "max_ticks": max_ticks, "priority": priority, "venue": venue}
+        return self._request({"op": "submit", "spec": spec})["job"]
+
+    def cancel(self, job:int) -> dict:
+        return self._request({"op": "cancel", "job": job})
+
+    def status(self) -> list:
+        return self._request({"op": "status"})["jobs"]
+
+    def watch(self, job:int):
+        """Yields the messages of a job as its runs finish, until it ends."""
+        message = self._request({"op": "watch", "job": job})
+        while True:
+            yield message
+            if message["event"] in ("done", "cancelled", "failed"):
+                return
+            message = self._receive()
+
+    def close(self) -> None:
+        self.file.close()
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves a queue of simulation sweeps.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket to listen on.")
+    parser.add_argument("--port", type=int, help="Localhost TCP port to listen on instead of the socket.")
+    parser.add_argument("--max-concurrency", type=int, help="Maximal number of runs at a time.")
+    parser.add_argument("--state-file", default=STATE_FILE, help="File the queue is persisted in.")
+    arguments = parser.parse_args()
+    service = JobService(arguments.state_file, arguments.max_concurrency)
+    asyncio.run(service.serve(arguments.socket, arguments.port))
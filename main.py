@@ -1,5 +1,13 @@
 from simulation import Simulation
+from venue import venue_for
+from runcache import cached_run
+from sweep import AdaptiveSweep, Study
+from design import space_filling_design, ResponseSurface
+from workqueue import WorkQueue, start_local_workers
+from constants import CSV_FILE_NAME, COLUMN_NAMES
+import csv
 import random
+import time
 import numpy as np
 
 def set_seed(seed: int) -> None:
@@ -17,24 +25,108 @@ def main() -> None:
     simulation = Simulation()
     simulation.main_loop()
 
-def run_experiments():
+def run_experiments(use_cache=True):
     '''
-    Multipe runs with the values to be tested
+    Multipe runs with the values to be tested. With use_cache every run is seeded with its repetition,
+    so points that were run before with the same model are read from the run cache
     '''
     avg_speeds = [1.4, 1.6, 2.0]
+    rows = []
     for run in range(10):
         print(f"RUN: {run+1}")
         for threshold in [2.0, 1.5]:
             for sigma in [0.01, 0.5]:
                 for speed in avg_speeds:
-                    simulation = Simulation()
-                    simulation.main_loop(avg_speed=speed, sigma=sigma, sep_threshold = threshold)
+                    if use_cache:
+                        result = cached_run(speed, sigma, threshold, seed=run)
+                    else:
+                        simulation = Simulation()
+                        result = simulation.main_loop(avg_speed=speed, sigma=sigma, sep_threshold = threshold)
+                    rows.append([result[column] for column in COLUMN_NAMES])
+
+    with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMN_NAMES)
+        writer.writerows(rows)
+
+def run_adaptive_experiments(rel_precision=0.02, max_runs=30, workers=None):
+    '''
+    The values of run_experiments, with as many runs per combination as its confidence intervals need
+    '''
+    combinations = [(speed, sigma, threshold) for threshold in [2.0, 1.5] for sigma in [0.01, 0.5] for speed in [1.4, 1.6, 2.0]]
+    sweep = AdaptiveSweep(combinations, rel_precision=rel_precision, max_runs=max_runs, workers=workers)
+    for summary in sweep.run():
+        print(summary)
+
+    with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMN_NAMES)
+        writer.writerows(sweep.rows())
+
+def run_space_filling_study(n=16, method="sobol", replicas=2, workers=None):
+    '''
+    Runs n points spread over continuous ranges of the parameters with common random numbers,
+    and fits a response surface of the evacuation time and the panic to them
+    '''
+    points = space_filling_design({"avg_speed": (1.2, 2.2), "sigma": (0.0, 0.5), "sep_threshold": (1.0, 2.5)}, n, method)
+    study = Study(points, replicas=replicas, workers=workers).run()
+    rows = study.rows()
+    for column in ["avg_evac_time", "avg_panic"]:
+        surface = ResponseSurface(study.points(), [row[COLUMN_NAMES.index(column)] for row in rows])
+        print(f"{column}: R^2 of the response surface {surface.r_squared:.3f}")
+
+    with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMN_NAMES)
+        writer.writerows(rows)
+
+def run_distributed_experiments(replicas=10, local_workers=4, directory="cache/queue"):
+    '''
+    The values of run_experiments, queued in a shared directory. Workers on other nodes join with
+    python workqueue.py <directory>, local_workers run on this machine
+    '''
+    combinations = [(speed, sigma, threshold) for threshold in [2.0, 1.5] for sigma in [0.01, 0.5] for speed in [1.4, 1.6, 2.0]]
+    queue = WorkQueue(directory)
+    keys = queue.submit(combinations, replicas)
+    workers = start_local_workers(local_workers, directory)
+    results = queue.wait(keys)
+    for worker in workers:
+        worker.join()
+
+    with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMN_NAMES)
+        writer.writerows([result[column] for column in COLUMN_NAMES] for result in results)
+
+def run_scaling_study(agent_counts=(240, 1000, 5000), kind="lecture_hall", max_ticks=50, strips=None):
+    '''
+    Headless runs in generated venues of increasing size, printing how long every stage of a tick takes.
+    With strips, the agents of every run are stepped by that many processes in parallel
+    '''
+    for agent_count in agent_counts:
+        start = time.perf_counter()
+        scenario = venue_for(agent_count, kind)
+        scenario.flow_field
+        setup_time = time.perf_counter() - start
+
+        simulation = Simulation(run_name=f"Scaling_{kind}_{agent_count}.csv", show_plots=False, scenario=scenario, render=False, strips=strips)
+        simulation.main_loop(max_ticks=max_ticks)
+        stages = ", ".join(f"{stage}: {1000 * seconds / simulation.ticks:.2f} ms" for stage, seconds in simulation.stage_times.items())
+        print(f"{kind} with {agent_count} agents ({scenario.box_width}x{scenario.box_height}): setup {setup_time:.2f} s, per tick {stages}")
 
 if __name__=="__main__":
     set_seed(42)  # Set seed for reproducibility
 
     # Uncomment to run a multiple experiments
     # run_experiments()
+    # Uncomment to replicate every combination until its confidence intervals are narrow enough
+    # run_adaptive_experiments()
+    # Uncomment to sample the parameters with a Sobol design and fit response surfaces
+    # run_space_filling_study()
+    # Uncomment to run the experiments through a work queue that workers on several nodes share
+    # run_distributed_experiments()
+    # Uncomment to measure how every stage scales with the venue size
+    # run_scaling_study()
     main()
     
     
@@ -4,13 +4,315 @@ import csv
 import numpy as np
 import glob
 import pandas as pd
+from collections import OrderedDict
 from constants import CSV_FILE_NAME
 
+class CongestionHeatmap:
+    """
+    Accumulates agent positions and panic into a fixed 2D grid over the hall on every tick.
+    Memory does not grow with the length of a run, and heatmaps of several runs can be merged.
+    """
+    def __init__(self, bounds:tuple, bins:tuple=(52, 30), number_of_agents:int=0) -> None:
+        """
+        Parameters:
+            bounds (tuple): (left, top, width, height) of the area covered by the grid.
+            bins (tuple): Number of cells along x and y.
+            number_of_agents (int): Number of agents, needed to count how often agents enter a cell.
+        """
+        self.bounds = tuple(bounds)
+        self.bins = tuple(bins)
+        left, top, width, height = self.bounds
+        self.range = [[left, left + width], [top, top + height]]
+        self.ticks = 0
+        # Agent-ticks, summed panic and entries per cell, indexed [x, y]
+        self.counts = np.zeros(self.bins)
+        self.panic_sums = np.zeros(self.bins)
+        self.entries = np.zeros(self.bins)
+        self.last_cell = np.full(number_of_agents, -1)
+
+    def accumulate(self, ids:np.ndarray, positions:np.ndarray, panic:np.ndarray) -> None:
+        """
+        Adds one tick of agent positions and panic levels to the grid.
+
+        Parameters:
+            ids (np.ndarray): Agent IDs.
+            positions (np.ndarray): (n, 2) agent positions.
+            panic (np.ndarray): Agent panic levels.
+        """
+        self.ticks += 1
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if len(positions) == 0:
+            return
+        counts, _, _ = np.histogram2d(positions[:, 0], positions[:, 1], bins=self.bins, range=self.range)
+        panic_sums, _, _ = np.histogram2d(positions[:, 0], positions[:, 1], bins=self.bins, range=self.range, weights=panic)
+        self.counts += counts
+        self.panic_sums += panic_sums
+
+        # An agent enters a cell when it is in a different cell than on the tick before
+        left, top, width, height = self.bounds
+        x = np.clip(((positions[:, 0] - left) / width * self.bins[0]).astype(int), 0, self.bins[0] - 1)
+        y = np.clip(((positions[:, 1] - top) / height * self.bins[1]).astype(int), 0, self.bins[1] - 1)
+        cells = x * self.bins[1] + y
+        entered = self.last_cell[ids] != cells
+        np.add.at(self.entries.reshape(-1), cells[entered], 1)
+        self.last_cell[ids] = cells
+
+    @property
+    def occupancy(self) -> np.ndarray:
+        """Mean number of agents per cell and tick."""
+        return self.counts / max(self.ticks, 1)
+
+    @property
+    def mean_panic(self) -> np.ndarray:
+        """Mean panic of the agents in a cell, NaN for cells no agent entered."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.panic_sums / self.counts, np.nan)
+
+    @property
+    def dwell_time(self) -> np.ndarray:
+        """Mean number of ticks an agent stays in a cell after entering it, NaN for cells no agent entered."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.entries > 0, self.counts / self.entries, np.nan)
+
+    def merge(self, other:"CongestionHeatmap") -> None:
+        """
+        Adds the accumulated grid of another run with the same bounds and bins.
+
+        Parameters:
+            other (CongestionHeatmap): Heatmap to merge into this one.
+        """
+        if other.bounds != self.bounds or other.bins != self.bins:
+            raise ValueError(f"Cannot merge heatmaps with bounds {other.bounds} and bins {other.bins} into {self.bounds} and {self.bins}.")
+        self.ticks += other.ticks
+        self.counts += other.counts
+        self.panic_sums += other.panic_sums
+        self.entries += other.entries
+
+    def save(self, path:str) -> None:
+        """Saves the accumulated grid to a .npz file."""
+        np.savez_compressed(path, bounds=self.bounds, bins=self.bins, ticks=self.ticks,
+                            counts=self.counts, panic_sums=self.panic_sums, entries=self.entries)
+
+    @classmethod
+    def load(cls, path:str) -> "CongestionHeatmap":
+        """Loads a grid saved with `save`."""
+        with np.load(path) as data:
+            heatmap = cls(tuple(data['bounds'].tolist()), tuple(data['bins'].tolist()))
+            heatmap.ticks = int(data['ticks'])
+            heatmap.counts = data['counts']
+            heatmap.panic_sums = data['panic_sums']
+            heatmap.entries = data['entries']
+        return heatmap
+
+    def plot(self, save_directory:str='plots', name:str='heatmap') -> None:
+        """
+        Plots and saves the occupancy, mean-panic and dwell-time maps.
+
+        Parameters:
+            save_directory (str): Directory to save the plot image.
+            name (str): Prefix of the file name.
+        """
+        import os
+        os.makedirs(save_directory, exist_ok=True)
+        left, top, width, height = self.bounds
+        fig, axes = plt.subplots(1, 3, figsize=(18, 4))
+        for ax, data, title in zip(axes, (self.occupancy, self.mean_panic, self.dwell_time),
+                                   ('Occupancy (agents per tick)', 'Mean Panic Level', 'Dwell Time (ticks)')):
+            image = ax.imshow(data.T, origin='upper', extent=(left, left + width, top + height, top), cmap='magma')
+            ax.set_title(title)
+            fig.colorbar(image, ax=ax)
+        heatmap_path = os.path.join(save_directory, f'{name}.png')
+        fig.savefig(heatmap_path, bbox_inches='tight')
+        plt.show()
+
+
+class ExitFlow:
+    """
+    Records, per exit and tick, the number of escaped agents and the density and mean speed
+    of the agents in a measurement box in front of the exit.
+    """
+    def __init__(self, boxes:list) -> None:
+        """
+        Parameters:
+            boxes (list): (left, top, width, height) of the measurement box of every exit.
+        """
+        self.boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+        self.areas = self.boxes[:, 2] * self.boxes[:, 3]
+        # Rows of the recorded ticks, grown by doubling
+        self.ticks = 0
+        self._escapes = np.zeros((0, len(self.boxes)), dtype=np.int32)
+        self._densities = np.zeros((0, len(self.boxes)), dtype=np.float32)
+        self._speeds = np.zeros((0, len(self.boxes)), dtype=np.float32)
+
+    def _grow(self) -> None:
+        if self.ticks == len(self._escapes):
+            extra = max(self.ticks, 64)
+            self._escapes = np.concatenate((self._escapes, np.zeros((extra, len(self.boxes)), dtype=np.int32)))
+            self._densities = np.concatenate((self._densities, np.zeros((extra, len(self.boxes)), dtype=np.float32)))
+            self._speeds = np.concatenate((self._speeds, np.zeros((extra, len(self.boxes)), dtype=np.float32)))
+
+    def record(self, exit_ids:np.ndarray, positions:np.ndarray, speeds:np.ndarray) -> None:
+        """
+        Records one tick.
+
+        Parameters:
+            exit_ids (np.ndarray): Index of the exit of every agent that escaped this tick.
+            positions (np.ndarray): (n, 2) positions of the agents still in the hall.
+            speeds (np.ndarray): Speeds of the agents still in the hall.
+        """
+        n_exits = len(self.boxes)
+        self._grow()
+        tick = self.ticks
+        self._escapes[tick] = np.bincount(np.asarray(exit_ids, dtype=int), minlength=n_exits)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        speeds = np.asarray(speeds, dtype=float)
+        densities = self._densities[tick]
+        mean_speeds = self._speeds[tick]
+        mean_speeds[:] = np.nan
+        for i, (left, top, width, height) in enumerate(self.boxes):
+            inside = ((left <= positions[:, 0]) & (positions[:, 0] < left + width) &
+                      (top <= positions[:, 1]) & (positions[:, 1] < top + height))
+            count = np.count_nonzero(inside)
+            densities[i] = count / self.areas[i]
+            if count:
+                mean_speeds[i] = speeds[inside].mean()
+        self.ticks += 1
+
+    @property
+    def escapes(self) -> np.ndarray:
+        """(ticks, exits) number of agents that escaped through every exit per tick."""
+        return self._escapes[:self.ticks]
+
+    @property
+    def densities(self) -> np.ndarray:
+        """(ticks, exits) agents per square pixel in the measurement boxes."""
+        return self._densities[:self.ticks]
+
+    @property
+    def speeds(self) -> np.ndarray:
+        """(ticks, exits) mean speed in the measurement boxes in pixels per tick, NaN for empty boxes."""
+        return self._speeds[:self.ticks]
+
+    def flow_rate(self, window:int=50) -> np.ndarray:
+        """
+        Returns the flow through every exit in agents per tick, as a moving average over window ticks.
+
+        Parameters:
+            window (int): Number of ticks to average over, at most the number of recorded ticks.
+        """
+        escapes = self.escapes
+        # A window longer than the run would pad the result to the window length
+        window = max(1, min(window, len(escapes)))
+        kernel = np.ones(window) / window
+        return np.column_stack([np.convolve(escapes[:, i], kernel, mode='same') for i in range(escapes.shape[1])])
+
+    def fundamental_diagram(self, exit_id:int=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (density, speed) samples of the ticks with agents in the measurement box.
+
+        Parameters:
+            exit_id (int): Exit to take the samples from, all exits if None.
+        """
+        densities, speeds = self.densities, self.speeds
+        if exit_id is not None:
+            densities, speeds = densities[:, exit_id], speeds[:, exit_id]
+        occupied = ~np.isnan(speeds)
+        return densities[occupied], speeds[occupied]
+
+    def save(self, path:str) -> None:
+        """Saves the recorded arrays to a .npz file."""
+        np.savez_compressed(path, boxes=self.boxes, escapes=self.escapes, densities=self.densities, speeds=self.speeds)
+
+    def plot(self, save_directory:str='plots', name:str='exit_flow') -> None:
+        """
+        Plots and saves the flow over time of every exit and the fundamental diagram.
+
+        Parameters:
+            save_directory (str): Directory to save the plot image.
+            name (str): Prefix of the file name.
+        """
+        import os
+        os.makedirs(save_directory, exist_ok=True)
+        fig, (flow_ax, diagram_ax) = plt.subplots(1, 2, figsize=(12, 4))
+        for exit_id, flow in enumerate(self.flow_rate().T):
+            flow_ax.plot(flow, label=f'Exit {exit_id + 1}')
+            density, speed = self.fundamental_diagram(exit_id)
+            diagram_ax.scatter(density, speed, s=4, alpha=0.5, label=f'Exit {exit_id + 1}')
+        flow_ax.set_xlabel('Tick')
+        flow_ax.set_ylabel('Flow (agents per tick)')
+        flow_ax.legend()
+        diagram_ax.set_xlabel('Density (agents per px²)')
+        diagram_ax.set_ylabel('Speed (px per tick)')
+        diagram_ax.legend()
+        exit_flow_path = os.path.join(save_directory, f'{name}.png')
+        fig.savefig(exit_flow_path, bbox_inches='tight')
+        plt.show()
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch with logarithmic buckets (as in DDSketch): every quantile of
+    positive values is estimated within the relative accuracy, with memory bounded by the range of the values.
+    """
+    def __init__(self, relative_accuracy:float=0.01) -> None:
+        """
+        Parameters:
+            relative_accuracy (float): Maximal relative error of the estimated quantiles.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values) -> None:
+        """Adds a value or an array of values."""
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        self.count += len(values)
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive) / np.log(self.gamma)).astype(int), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other:"QuantileSketch") -> None:
+        """Adds the values of another sketch with the same relative accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Cannot merge sketches with relative accuracies {other.relative_accuracy} and {self.relative_accuracy}.")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q:float) -> float:
+        """
+        Estimates the q-quantile of the added values.
+
+        Parameters:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            float: The estimated quantile, or None if no values were added.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
 class Metrics:
     """
     Tracks and visualizes simulation metrics, such as escape times and panic levels, for agents in a simulation.
     """
-    def __init__(self, number_of_agents:int, run_name:str=CSV_FILE_NAME, initial_tick:int=0) -> None:
+    def __init__(self, number_of_agents:int, run_name:str=CSV_FILE_NAME, initial_tick:int=0,
+                 heatmap_bounds:tuple=None, heatmap_bins:tuple=None, exit_boxes:list=None, streaming:bool=False) -> None:
         """
         Initializes the metrics tracker with initial values for each agent.
 
@@ -18,12 +320,33 @@ class Metrics:
             number_of_agents (int): Number of agents to track.
             run_name (str): Filename for saving metrics data.
             initial_tick (int): Initial tick value, default is 0.
+            heatmap_bounds (tuple): (left, top, width, height) of the hall, enables the congestion heatmap.
+            heatmap_bins (tuple): Number of heatmap cells along x and y.
+            exit_boxes (list): Measurement box in front of every exit, enables the exit flow recording.
+            streaming (bool): Keep running panic statistics per agent instead of every panic level,
+                so memory does not grow with the length of the run.
         """
         self.number_of_agents = number_of_agents
         self.agent_ticks = [initial_tick for _ in range(number_of_agents)]
-        self.agent_panic = [[] for _ in range(number_of_agents)]
         self.agent_escaped = [False for _ in range(number_of_agents)]
         self.run_name = run_name
+        self.streaming = streaming
+        if streaming:
+            # Welford's running count, mean and sum of squared deviations of the panic level per agent
+            self.agent_panic = None
+            self.panic_count = np.zeros(number_of_agents, dtype=int)
+            self.panic_mean = np.zeros(number_of_agents)
+            self.panic_m2 = np.zeros(number_of_agents)
+            self.panic_over_time = []
+        else:
+            self.agent_panic = [[] for _ in range(number_of_agents)]
+        self.escape_time_sketch = QuantileSketch()
+        self.heatmap = None
+        if heatmap_bounds is not None:
+            self.heatmap = CongestionHeatmap(heatmap_bounds, heatmap_bins or (52, 30), number_of_agents)
+        self.exit_flow = None
+        if exit_boxes is not None:
+            self.exit_flow = ExitFlow(exit_boxes)
     
     def increment_tick(self) -> None:
         """Increments the tick count for each agent that has not escaped."""
@@ -40,6 +363,7 @@ class Metrics:
         """
         for agent in agents:
             self.agent_escaped[agent.id] = True
+        self.escape_time_sketch.add([self.agent_ticks[agent.id] for agent in agents])
 
     def update_panic_levels(self, agents:list) -> None:
         """
@@ -48,10 +372,49 @@ class Metrics:
         Parameters:
             agents (list): List of agent objects with attributes 'id' and 'panic'.
         """
+        if self.streaming:
+            active = [agent for agent in agents if not self.agent_escaped[agent.id]]
+            if not active:
+                return
+            ids = np.array([agent.id for agent in active], dtype=int)
+            panic = np.array([agent.panic for agent in active], dtype=float)
+            self.panic_count[ids] += 1
+            delta = panic - self.panic_mean[ids]
+            self.panic_mean[ids] += delta / self.panic_count[ids]
+            self.panic_m2[ids] += delta * (panic - self.panic_mean[ids])
+            self.panic_over_time.append(panic.mean())
+            return
         for agent in agents:
             if not self.agent_escaped[agent.id]:
                 self.agent_panic[agent.id].append(agent.panic)
 
+    def update_heatmap(self, agents:list) -> None:
+        """
+        Adds the positions and panic levels of the agents to the congestion heatmap, if it is enabled.
+
+        Parameters:
+            agents (list): List of agent objects with attributes 'id', 'position' and 'panic'.
+        """
+        if self.heatmap is None:
+            return
+        ids = np.array([agent.id for agent in agents], dtype=int)
+        positions = np.array([(agent.position.x, agent.position.y) for agent in agents], dtype=float)
+        panic = np.array([agent.panic for agent in agents], dtype=float)
+        self.heatmap.accumulate(ids, positions, panic)
+
+    def record_exit_flow(self, exit_ids:np.ndarray, positions:np.ndarray, speeds:np.ndarray) -> None:
+        """
+        Records the escapes per exit and the density and speed in front of the exits, if enabled.
+
+        Parameters:
+            exit_ids (np.ndarray): Index of the exit of every agent that escaped this tick.
+            positions (np.ndarray): (n, 2) positions of the agents still in the hall.
+            speeds (np.ndarray): Distance every agent still in the hall moved this tick.
+        """
+        if self.exit_flow is None:
+            return
+        self.exit_flow.record(exit_ids, positions, speeds)
+
         
     def get_last_tick_of_agent(self, agent_id:int) -> int:
         """
@@ -80,8 +443,53 @@ class Metrics:
         Returns:
             list: Average panic level for each agent.
         """
+        if self.streaming:
+            return [mean if count else 0 for mean, count in zip(self.panic_mean.tolist(), self.panic_count.tolist())]
         return [sum(panic) / len(panic) if panic else 0 for panic in self.agent_panic]
 
+    def mean_panic_per_agent(self) -> np.ndarray:
+        """
+        Returns the mean panic level of each agent, NaN for agents without recorded panic levels.
+        """
+        if self.streaming:
+            return np.where(self.panic_count > 0, self.panic_mean, np.nan)
+        return np.array([np.mean(panic) if panic else np.nan for panic in self.agent_panic])
+
+    def calculate_panic_variance(self) -> np.ndarray:
+        """
+        Returns the sample variance of the panic level of each agent, NaN for agents with less than two levels.
+        """
+        if self.streaming:
+            return np.where(self.panic_count > 1, self.panic_m2 / np.maximum(self.panic_count - 1, 1), np.nan)
+        return np.array([np.var(panic, ddof=1) if len(panic) > 1 else np.nan for panic in self.agent_panic])
+
+    def average_panic_over_time(self) -> list:
+        """
+        Returns the average panic level of the agents in the hall, per tick.
+        """
+        if self.streaming:
+            return list(self.panic_over_time)
+        avg_panic_over_time = []
+        for i in range(self.last_tick):
+            panic_values = [panic[i] for panic in self.agent_panic  if len(panic) > i]
+            if not panic_values:
+                break
+            else:
+                avg_panic_over_time.append(sum(panic_values) / len(panic_values))
+        return avg_panic_over_time
+
+    def escape_time_quantiles(self, quantiles:list=(0.1, 0.5, 0.9)) -> dict:
+        """
+        Estimates quantiles of the escape times with the streaming sketch.
+
+        Parameters:
+            quantiles (list): Quantiles between 0 and 1.
+
+        Returns:
+            dict: Estimated escape time per quantile.
+        """
+        return {q: self.escape_time_sketch.quantile(q) for q in quantiles}
+
     def calculate_escape_statistics(self) -> dict:
         """
         Calculates statistics for escape times among agents who have escaped.
@@ -119,14 +527,7 @@ class Metrics:
         """
         import os 
         os.makedirs(save_directory, exist_ok=True)
-        avg_panic_over_time = []
-
-        for i in range(self.last_tick):
-            panic_values = [panic[i] for panic in self.agent_panic  if len(panic) > i]
-            if not panic_values:
-                break
-            else:
-                avg_panic_over_time.append(sum(panic_values) / len(panic_values))
+        avg_panic_over_time = self.average_panic_over_time()
 
         plt.plot(avg_panic_over_time, color='red')
         plt.xlabel('Tick')
@@ -138,7 +539,7 @@ class Metrics:
 
     def show_mean_panic_distribution(self) -> None:
         """Displays a histogram showing the distribution of mean panic levels across agents."""
-        flat_panic = [np.mean(panics) for panics in self.agent_panic]
+        flat_panic = self.mean_panic_per_agent()
         plt.hist(flat_panic, bins=20, color='green', edgecolor='black')
         plt.xlabel('Panic Level')
         plt.ylabel('Frequency')
@@ -162,30 +563,31 @@ class Metrics:
         with open(save_filename, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(['Agent ID', 'Ticks to Exit', 'Average Panic Level'])
-            for agent_id in range(self.number_of_agents):
-                avg_panic = (
-                    sum(self.agent_panic[agent_id]) / len(self.agent_panic[agent_id])
-                    if self.agent_panic[agent_id] else 0
-                )
+            for agent_id, avg_panic in enumerate(self.calculate_average_panic()):
                 writer.writerow([agent_id, self.agent_ticks[agent_id], avg_panic])
+        if self.heatmap is not None:
+            self.heatmap.save(heatmap_path(save_filename))
+        if self.exit_flow is not None:
+            self.exit_flow.save(f"{save_filename[:-4]}_exit_flow.npz")
 
-def plot_boxplots_from_runs(csv_files:list, save_directory:str='plots'):
+def plot_boxplots_from_runs(csv_files:list, save_directory:str='plots', workers:int=None):
     """
     Plots and saves boxplots of escape times and mean panic levels from multiple runs.
 
     Parameters:
         csv_files (list): List of CSV file paths.
         save_directory (str): Directory to save the plots.
+        workers (int): Number of processes parsing the files that are not cached.
     """
     import os
     os.makedirs(save_directory, exist_ok=True)
     escape_times_runs = []
     average_panic_levels_runs = []
 
+    runs = dict(iter_runs(csv_files, workers=workers))
     for csv_file in csv_files:
-        df = pd.read_csv(csv_file)
-        escape_times = df['Ticks to Exit'].tolist()
-        average_panic_levels = df['Average Panic Level'].tolist()
+        escape_times = runs[csv_file]['Ticks to Exit'].tolist()
+        average_panic_levels = runs[csv_file]['Average Panic Level'].tolist()
 
         print(f"Mean escape Time for {csv_file}: {sum(escape_times)/len(escape_times)}")
         print(f"Average Panic Level for {csv_file}: {sum(average_panic_levels)/len(average_panic_levels)}")
@@ -217,27 +619,198 @@ def plot_boxplots_from_runs(csv_files:list, save_directory:str='plots'):
 
     print(f"Plots saved to {save_directory}")
 
-def average_over_subruns(file_names:list) -> None:
+def heatmap_path(csv_file:str) -> str:
+    """Returns the path of the heatmap saved beside the CSV file of a run."""
+    return f"{csv_file[:-4]}_heatmap.npz"
+
+def merge_heatmaps(csv_files:list) -> CongestionHeatmap:
     """
-    Averages data over subruns for each main file and saves the result.
+    Merges the heatmaps saved beside the CSV files of several runs, e.g. all subruns of a sweep.
 
     Parameters:
-        file_names (list): List of main file names to average over their subruns.
+        csv_files (list): List of CSV file paths.
+
+    Returns:
+        CongestionHeatmap: The merged heatmap, or None if no run saved one.
     """
-    for file_name in file_names:
-        sub_run_files = glob.glob(f"{file_name[:-4]}_subrun_*")
-        subrun_dfs = []
+    import os
+    merged = None
+    for csv_file in csv_files:
+        if not os.path.exists(heatmap_path(csv_file)):
+            continue
+        heatmap = CongestionHeatmap.load(heatmap_path(csv_file))
+        if merged is None:
+            merged = heatmap
+        else:
+            merged.merge(heatmap)
+    return merged
 
-        for subrun_file in sub_run_files:
-            df = pd.read_csv(subrun_file)
-            subrun_dfs.append(df)
+RUN_COLUMNS = ['Agent ID', 'Ticks to Exit', 'Average Panic Level']
+RUN_CACHE_SIZE = 256
+# Directory the parsed columns of run CSVs are kept in between processes
+PARSED_RUNS_DIRECTORY = "cache/parsed_runs"
 
-        if not subrun_dfs:
-            return None
+# Parsed run CSVs by path, with the modification time they were parsed at, least recently used first
+_run_cache = OrderedDict()
+
+def _parsed_path(csv_file:str) -> str:
+    import hashlib
+    import os
+    name = hashlib.sha256(os.path.abspath(csv_file).encode()).hexdigest()
+    return os.path.join(PARSED_RUNS_DIRECTORY, f"{name}.npz")
+
+def _load_parsed_run(csv_file:str, mtime:int) -> dict:
+    """Returns the columns of a run CSV parsed by an earlier process, or None if the file changed since."""
+    try:
+        with np.load(_parsed_path(csv_file)) as data:
+            if int(data['mtime']) != mtime:
+                return None
+            return {column: data[f'column_{i}'] for i, column in enumerate(RUN_COLUMNS)}
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+
+def _save_parsed_run(csv_file:str, mtime:int, run:dict) -> None:
+    import os
+    os.makedirs(PARSED_RUNS_DIRECTORY, exist_ok=True)
+    path = _parsed_path(csv_file)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, mtime=mtime, **{f'column_{i}': np.asarray(run[column]) for i, column in enumerate(RUN_COLUMNS)})
+    os.replace(temporary_path, path)
+
+def _cache_run(csv_file:str, mtime:int, run:dict, persist:bool=True) -> None:
+    _run_cache[csv_file] = (mtime, run)
+    _run_cache.move_to_end(csv_file)
+    while len(_run_cache) > RUN_CACHE_SIZE:
+        _run_cache.popitem(last=False)
+    if persist:
+        _save_parsed_run(csv_file, mtime, run)
+
+def _parse_runs(csv_files:list) -> list:
+    """Parses a chunk of run CSV files into dicts of column arrays."""
+    runs = []
+    for csv_file in csv_files:
+        df = pd.read_csv(csv_file, usecols=RUN_COLUMNS)
+        runs.append({column: df[column].to_numpy() for column in RUN_COLUMNS})
+    return runs
+
+def iter_runs(csv_files:list, workers:int=None, chunk_size:int=64):
+    """
+    Yields (csv_file, columns) for every run CSV file, with columns a dict of arrays per column.
+    Files that did not change since they were last parsed come first, from memory or from the parsed
+    columns in `PARSED_RUNS_DIRECTORY` that earlier processes left, keyed by path and modification time.
+    The others are parsed in chunks, by a process pool if there is more than one chunk.
+
+    Parameters:
+        csv_files (list): List of CSV file paths.
+        workers (int): Number of processes, defaults to the number of CPUs. 1 parses in this process.
+        chunk_size (int): Number of files parsed at once.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    stale = []
+    for csv_file in csv_files:
+        mtime = os.stat(csv_file).st_mtime_ns
+        cached = _run_cache.get(csv_file)
+        if cached is not None and cached[0] == mtime:
+            _run_cache.move_to_end(csv_file)
+            yield csv_file, cached[1]
+            continue
+        run = _load_parsed_run(csv_file, mtime)
+        if run is not None:
+            _cache_run(csv_file, mtime, run, persist=False)
+            yield csv_file, run
+        else:
+            stale.append((csv_file, mtime))
+
+    chunks = [stale[i:i + chunk_size] for i in range(0, len(stale), chunk_size)]
+    paths = [[csv_file for csv_file, _ in chunk] for chunk in chunks]
+    pool = ProcessPoolExecutor(workers) if len(chunks) > 1 and workers != 1 else None
+    try:
+        parsed_chunks = pool.map(_parse_runs, paths) if pool else map(_parse_runs, paths)
+        for chunk, runs in zip(chunks, parsed_chunks):
+            for (csv_file, mtime), run in zip(chunk, runs):
+                _cache_run(csv_file, mtime, run)
+                yield csv_file, run
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+class RunAggregate:
+    """
+    Running per-agent sums of escape times and panic levels over runs, to average
+    subruns without holding them in memory at once.
+    """
+    def __init__(self) -> None:
+        self.ticks = np.zeros(0)
+        self.panic = np.zeros(0)
+        self.counts = np.zeros(0, dtype=int)
+
+    def _grow(self, size:int) -> None:
+        if size > len(self.counts):
+            extra = size - len(self.counts)
+            self.ticks = np.concatenate((self.ticks, np.zeros(extra)))
+            self.panic = np.concatenate((self.panic, np.zeros(extra)))
+            self.counts = np.concatenate((self.counts, np.zeros(extra, dtype=int)))
+
+    def add(self, run:dict) -> None:
+        """
+        Adds one run.
+
+        Parameters:
+            run (dict): Arrays of the columns in `RUN_COLUMNS`.
+        """
+        ids = run['Agent ID'].astype(int)
+        if len(ids) == 0:
+            return
+        self._grow(ids.max() + 1)
+        np.add.at(self.ticks, ids, run['Ticks to Exit'])
+        np.add.at(self.panic, ids, run['Average Panic Level'])
+        np.add.at(self.counts, ids, 1)
+
+    def merge(self, other:"RunAggregate") -> None:
+        """Adds the sums of another aggregate."""
+        self._grow(len(other.counts))
+        size = len(other.counts)
+        self.ticks[:size] += other.ticks
+        self.panic[:size] += other.panic
+        self.counts[:size] += other.counts
+
+    def mean(self) -> dict:
+        """Returns the per-agent means as a dict of arrays per column, for the agents in any run."""
+        ids = np.flatnonzero(self.counts)
+        return {'Agent ID': ids,
+                'Ticks to Exit': self.ticks[ids] / self.counts[ids],
+                'Average Panic Level': self.panic[ids] / self.counts[ids]}
+
+def average_over_subruns(file_names:list, workers:int=None) -> dict:
+    """
+    Averages data over subruns for each main file and saves the result.
+
+    Parameters:
+        file_names (list): List of main file names to average over their subruns.
+        workers (int): Number of processes parsing the subrun files that are not cached.
 
-        all_subruns_df = pd.concat(subrun_dfs)
-        averaged_df = all_subruns_df.groupby('Agent ID').mean()
-        averaged_df.to_csv(file_name)
+    Returns:
+        dict: RunAggregate per main file that has subruns.
+    """
+    import os
+    aggregates = {}
+    for file_name in file_names:
+        sub_run_files = sorted(glob.glob(f"{file_name[:-4]}_subrun_*.csv"))
+        if not sub_run_files:
+            continue
+
+        aggregate = RunAggregate()
+        for _, run in iter_runs(sub_run_files, workers=workers):
+            aggregate.add(run)
+        aggregates[file_name] = aggregate
+
+        averaged = aggregate.mean()
+        pd.DataFrame(averaged).set_index('Agent ID').to_csv(file_name)
+        # The boxplots read the averaged file right away, it does not have to be parsed again
+        _cache_run(file_name, os.stat(file_name).st_mtime_ns, averaged)
+    return aggregates
 
 if __name__=="__main__":
     # search for csv files in run-folder
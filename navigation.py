@@ -0,0 +1,116 @@
+import heapq
+import math
+import numpy as np
+import pygame
+
+# Relative cost of crossing a cell covered by an obstacle, so agents pushed into one still find their way out
+OBSTACLE_COST = 10
+
+# 8-neighbourhood as (row offset, column offset)
+NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+class FlowField:
+    """
+    Grid over the hall that stores, for every cell, the length of the shortest path around the
+    obstacles to the nearest exit and the direction in which that path starts.
+    """
+    def __init__(self, distance:np.ndarray, direction:np.ndarray, left:float, top:float, cell_size:float) -> None:
+        """
+        Parameters:
+            distance (np.ndarray): (rows, columns) path length to the nearest exit per cell.
+            direction (np.ndarray): (rows, columns, 2) unit vector along the path per cell.
+            left, top (float): Position of the upper left corner of the grid.
+            cell_size (float): Side length of a cell.
+        """
+        self.distance = distance
+        self.direction = direction
+        self.left = left
+        self.top = top
+        self.cell_size = cell_size
+
+    @classmethod
+    def from_scenario(cls, scenario, cell_size:float=None) -> "FlowField":
+        """
+        Builds the flow field of a scenario with Dijkstra's algorithm, starting from the cells in front of the exits.
+
+        Parameters:
+            scenario (Scenario): The hall to navigate.
+            cell_size (float): Side length of a cell, defaults to the diameter of an agent.
+        """
+        if cell_size is None:
+            cell_size = 2 * scenario.agent_radius
+        columns = math.ceil(scenario.box_width / cell_size)
+        rows = math.ceil(scenario.box_height / cell_size)
+        center_x = scenario.box_left + (np.arange(columns) + 0.5) * cell_size
+        center_y = scenario.box_top + (np.arange(rows) + 0.5) * cell_size
+
+        cost = np.ones((rows, columns))
+        for left, top, width, height in scenario.obstacle_array:
+            x_in = slice(np.searchsorted(center_x, left), np.searchsorted(center_x, left + width, side="right"))
+            y_in = slice(np.searchsorted(center_y, top), np.searchsorted(center_y, top + height, side="right"))
+            cost[y_in, x_in] = OBSTACLE_COST
+
+        exit_centers = np.array([(t.x, t.y) for t in scenario.exit_targets])
+        distance = np.full((rows, columns), np.inf)
+        nearest_exit = np.full((rows, columns), -1)
+        queue = []
+        for exit_id, (wall, low, high) in enumerate(scenario.exit_spans):
+            if wall == "top" or wall == "bottom":
+                row = 0 if wall == "top" else rows - 1
+                cells = [(row, column) for column in np.flatnonzero((low <= center_x) & (center_x <= high))]
+            else:
+                column = 0 if wall == "left" else columns - 1
+                cells = [(row, column) for row in np.flatnonzero((low <= center_y) & (center_y <= high))]
+            for row, column in cells:
+                d = math.dist((center_x[column], center_y[row]), exit_centers[exit_id])
+                if d < distance[row, column]:
+                    distance[row, column] = d
+                    nearest_exit[row, column] = exit_id
+                    heapq.heappush(queue, (d, row, column))
+
+        while queue:
+            d, row, column = heapq.heappop(queue)
+            if d > distance[row, column]:
+                continue
+            for dr, dc in NEIGHBOURS:
+                r, c = row + dr, column + dc
+                if 0 <= r < rows and 0 <= c < columns:
+                    step = cell_size * math.hypot(dr, dc) * (cost[row, column] + cost[r, c]) / 2
+                    if d + step < distance[r, c]:
+                        distance[r, c] = d + step
+                        nearest_exit[r, c] = nearest_exit[row, column]
+                        heapq.heappush(queue, (d + step, r, c))
+
+        # Every cell points to its neighbour closest to an exit, the cells in front of the exits to the exit itself
+        padded = np.pad(distance, 1, constant_values=np.inf)
+        neighbour_distances = np.stack([padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + columns] for dr, dc in NEIGHBOURS])
+        best = np.argmin(neighbour_distances, axis=0)
+        offsets = np.array(NEIGHBOURS, dtype=float)[best]
+        direction = offsets[..., ::-1].copy()
+        at_exit = np.min(neighbour_distances, axis=0) >= distance
+        grid_x, grid_y = np.meshgrid(center_x, center_y)
+        to_exit = exit_centers[nearest_exit] - np.stack((grid_x, grid_y), axis=-1)
+        direction[at_exit] = to_exit[at_exit]
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-12)
+
+        return cls(distance, direction, scenario.box_left, scenario.box_top, cell_size)
+
+    def cell_of(self, positions:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the (row, column) indices of the cells that contain the positions, clipped to the grid."""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        rows, columns = self.distance.shape
+        column = np.clip(((positions[:, 0] - self.left) // self.cell_size).astype(int), 0, columns - 1)
+        row = np.clip(((positions[:, 1] - self.top) // self.cell_size).astype(int), 0, rows - 1)
+        return row, column
+
+    def steering_at(self, position:pygame.Vector2) -> pygame.Vector2:
+        """
+        Returns a vector along the shortest path to the nearest exit, with the length of that path.
+
+        Parameters:
+            position (pygame.Vector2): Position of the agent.
+        """
+        (row,), (column,) = self.cell_of((position.x, position.y))
+        direction = self.direction[row, column]
+        return pygame.Vector2(float(direction[0]), float(direction[1])) * float(self.distance[row, column])
@@ -0,0 +1,147 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+class Neighborhood:
+    """
+    Neighborhood relation of the agents in one tick, stored as a sparse matrix of the pairwise
+    distances within perception. Neighbor counts, neighbor averages and separation forces for every
+    agent are derived from it with sparse matrix-vector products and cached per radius.
+
+    With k, the interaction is topological: every agent only sees its k nearest neighbors within
+    perception, found with one batched k-nearest-neighbor query. The work per agent is then bounded
+    however dense the crowd gets, and the nearest contacts that drive separation are always among them.
+    The relation is not symmetric anymore, an agent can be a neighbor of another without seeing it.
+    """
+    def __init__(self, agents:list, perception:float, k:int=None) -> None:
+        """
+        Parameters:
+            agents (list): The active agents, their order defines the rows of the matrices.
+            perception (float): Largest radius any neighbor query will use.
+            k (int): Number of nearest neighbors every agent interacts with, all within perception if None.
+        """
+        self.agents = agents
+        self._index([agent.id for agent in agents],
+                    np.array([(agent.position.x, agent.position.y) for agent in agents], dtype=float).reshape(-1, 2),
+                    np.array([(agent.velocity.x, agent.velocity.y) for agent in agents], dtype=float).reshape(-1, 2),
+                    np.array([agent.panic for agent in agents], dtype=float), perception, k)
+
+    @classmethod
+    def from_arrays(cls, ids:list, positions:np.ndarray, velocities:np.ndarray, panic:np.ndarray,
+                    perception:float, k:int=None) -> "Neighborhood":
+        """
+        Builds the neighborhood from the state of the agents instead of Agent objects, e.g. from
+        the shared memory of the strips of `decomposition.py`.
+        """
+        neighborhood = cls.__new__(cls)
+        neighborhood.agents = None
+        neighborhood._index(list(ids), np.asarray(positions, dtype=float).reshape(-1, 2),
+                            np.asarray(velocities, dtype=float).reshape(-1, 2), np.asarray(panic, dtype=float), perception, k)
+        return neighborhood
+
+    def _index(self, ids:list, positions:np.ndarray, velocities:np.ndarray, panic:np.ndarray, perception:float,
+               k:int=None) -> None:
+        self.rows = {id: row for row, id in enumerate(ids)}
+        self.n = len(ids)
+        self.positions = positions
+        self.velocities = velocities
+        self.panic = panic
+        self.k = k
+
+        tree = cKDTree(self.positions)
+        if k is None:
+            pairs = tree.query_pairs(perception, output_type="ndarray")
+            i, j = pairs[:, 0], pairs[:, 1]
+            i, j = np.concatenate((i, j)), np.concatenate((j, i))
+        else:
+            i, j = self._nearest_pairs(tree, perception, k)
+        # Agents kept their distances in integer arrays, the model is calibrated on truncated distances
+        self.pair_rows = i
+        self.pair_columns = j
+        self.pair_distances = np.trunc(np.linalg.norm(self.positions[i] - self.positions[j], axis=1))
+        self._cache = {}
+
+    def _nearest_pairs(self, tree:cKDTree, perception:float, k:int) -> tuple[np.ndarray, np.ndarray]:
+        """Directed pairs from every agent to its k nearest neighbors within perception."""
+        if self.n < 2 or k < 1:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        # One more than k, since every agent finds itself
+        _, neighbors = tree.query(self.positions, k=min(k + 1, self.n), distance_upper_bound=perception)
+        neighbors = neighbors.reshape(self.n, -1)
+        rows = np.broadcast_to(np.arange(self.n)[:, None], neighbors.shape)
+        valid = (neighbors < self.n) & (neighbors != rows)
+        # Agents on top of each other can push an agent out of its own list, keep at most k
+        valid &= np.cumsum(valid, axis=1) <= k
+        return rows[valid], neighbors[valid]
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def adjacency(self, radius:float) -> csr_matrix:
+        """Sparse 0/1 matrix of the pairs of agents closer than radius."""
+        def compute():
+            within = self.pair_distances < radius
+            return csr_matrix((np.ones(np.count_nonzero(within)), (self.pair_rows[within], self.pair_columns[within])),
+                              shape=(self.n, self.n))
+        return self._cached(("adjacency", radius), compute)
+
+    def count(self, radius:float) -> np.ndarray:
+        """Number of neighbors closer than radius, per agent."""
+        return self._cached(("count", radius), lambda: np.asarray(self.adjacency(radius).sum(axis=1)).ravel())
+
+    def _mean(self, name:str, values:np.ndarray, radius:float) -> np.ndarray:
+        def compute():
+            total = self.count(radius)
+            sums = self.adjacency(radius) @ values
+            divisor = np.maximum(total, 1)
+            return sums / (divisor[:, None] if sums.ndim == 2 else divisor)
+        return self._cached((name, radius), compute)
+
+    def mean_velocity(self, radius:float) -> np.ndarray:
+        """(n, 2) mean velocity of the neighbors closer than radius, zero without neighbors."""
+        return self._mean("velocity", self.velocities, radius)
+
+    def mean_position(self, radius:float) -> np.ndarray:
+        """(n, 2) mean position of the neighbors closer than radius, zero without neighbors."""
+        return self._mean("position", self.positions, radius)
+
+    def mean_panic(self, radius:float) -> np.ndarray:
+        """Mean panic of the neighbors closer than radius, zero without neighbors."""
+        return self._mean("panic", self.panic, radius)
+
+    def separation(self, radius:float) -> np.ndarray:
+        """
+        (n, 2) sum over the neighbors closer than radius of the vector pointing away from them,
+        weighted by how far they are inside radius.
+        """
+        def compute():
+            within = self.pair_distances < radius
+            weights = 1 / ((radius - self.pair_distances[within]) + 0.00000000001)
+            weighted = csr_matrix((weights, (self.pair_rows[within], self.pair_columns[within])), shape=(self.n, self.n))
+            row_weights = np.asarray(weighted.sum(axis=1)).ravel()
+            return self.positions * row_weights[:, None] - weighted @ self.positions
+        return self._cached(("separation", radius), compute)
+
+    def panic_clusters(self, radius:float, panic_threshold:float=0.5) -> tuple[int, np.ndarray]:
+        """
+        Finds groups of panicking agents that are connected through neighbors closer than radius.
+
+        Parameters:
+            radius (float): Distance within which two agents are connected.
+            panic_threshold (float): Panic level from which an agent counts as panicking.
+
+        Returns:
+            tuple: Number of clusters, and the cluster label per agent (-1 for agents that do not panic).
+        """
+        panicking = self.panic >= panic_threshold
+        if not panicking.any():
+            return 0, np.full(self.n, -1)
+        indices = np.flatnonzero(panicking)
+        _, labels = connected_components(self.adjacency(radius)[indices][:, indices], directed=False)
+        cluster_labels = np.full(self.n, -1)
+        cluster_labels[indices] = labels
+        return int(labels.max()) + 1, cluster_labels
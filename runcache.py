@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from simulation import Simulation
+from scenario import Scenario, DEFAULT_SCENARIO
+
+# Modules whose source defines the outcome of a run, a change to any of them invalidates the cache
+MODEL_MODULES = ["agent.py", "simulation.py", "subgoals.py", "scenario.py", "navigation.py",
+                 "neighborhood.py", "obstacle.py", "constants.py", "metrics.py", "continuum.py", "decomposition.py"]
+# Arguments of `Simulation` that change the outcome of a run and are therefore part of its key, with the
+# value they have in a plain run. Strip runs add up the neighbor terms in another order and drift apart.
+RESULT_OPTIONS = {"level_of_detail": False, "topological_k": None, "strips": 1}
+
+CACHE_DIRECTORY = "cache/runs"
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+
+@lru_cache(maxsize=None)
+def model_fingerprint() -> str:
+    """Returns a hash of the source of the model modules."""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in MODEL_MODULES:
+        with open(os.path.join(directory, module), 'rb') as file:
+            digest.update(module.encode())
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def run_key(avg_speed:float, sigma:float, sep_threshold:float, scenario:Scenario, seed:int, max_ticks:int=None,
+            options:dict=None) -> str:
+    """
+    Returns the content address of a run: a hash of its parameters, scenario, seed, the model version
+    and the `RESULT_OPTIONS` in options that differ from a plain run.
+    """
+    parameters = {"avg_speed": avg_speed, "sigma": sigma, "sep_threshold": sep_threshold, "max_ticks": max_ticks,
+                  "seed": seed, "scenario": scenario.fingerprint(), "model": model_fingerprint()}
+    for name, plain in RESULT_OPTIONS.items():
+        value = (options or {}).get(name)
+        if value is not None and value != plain:
+            parameters[name] = value
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class RunCache:
+    """
+    Results of runs on local disk, one JSON file per run key. When the files exceed max_bytes,
+    the least recently used ones are deleted.
+    """
+    def __init__(self, directory:str=CACHE_DIRECTORY, max_bytes:int=CACHE_MAX_BYTES) -> None:
+        """
+        Parameters:
+            directory (str): Directory of the cached results.
+            max_bytes (int): Size the cached results are evicted down to.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key:str) -> dict:
+        """
+        Returns the cached result of a run, or None on a miss.
+
+        Parameters:
+            key (str): Key of the run, see `run_key`.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                result = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # The modification time marks when a result was last used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Another worker sharing the cache evicted or replaced it after the read
+            pass
+        return result
+
+    def put(self, key:str, result:dict) -> None:
+        """
+        Stores the result of a run and evicts least recently used results if the cache is too large.
+
+        Parameters:
+            key (str): Key of the run, see `run_key`.
+            result (dict): JSON serializable result of the run.
+        """
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(result, file)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes least recently used results until the cache fits into max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cached_run(avg_speed:float, sigma:float, sep_threshold:float, scenario:Scenario=DEFAULT_SCENARIO, seed:int=None,
+               max_ticks:int=None, cache:RunCache=None, **simulation_kwargs) -> dict:
+    """
+    Runs `Simulation.main_loop`, or returns its result from the cache if the same run was done before.
+    Runs without a seed are not reproducible and always simulated.
+
+    Parameters:
+        avg_speed, sigma, sep_threshold: Parameters of `Simulation.main_loop`.
+        scenario (Scenario): The hall and crowd.
+        seed (int): Seed of the random generators.
+        max_ticks (int): Maximal number of ticks.
+        cache (RunCache): Cache to use, defaults to one in `CACHE_DIRECTORY`.
+        simulation_kwargs: Further arguments for `Simulation`, the `RESULT_OPTIONS` among them are part of the key.
+
+    Returns:
+        dict: The result of `Simulation.main_loop`.
+    """
+    if seed is None:
+        return Simulation(scenario=scenario, **simulation_kwargs).main_loop(avg_speed, sigma, sep_threshold, max_ticks=max_ticks)
+    if cache is None:
+        cache = RunCache()
+    key = run_key(avg_speed, sigma, sep_threshold, scenario, seed, max_ticks, simulation_kwargs)
+    result = cache.get(key)
+    if result is None:
+        simulation = Simulation(scenario=scenario, **simulation_kwargs)
+        result = simulation.main_loop(avg_speed, sigma, sep_threshold, max_ticks=max_ticks, seed=seed)
+        cache.put(key, result)
+    return result
@@ -0,0 +1,319 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import cached_property
+import numpy as np
+import pygame
+from obstacle import Obstacle
+from constants import (
+    SCALING,
+    WIDTH,
+    HEIGHT,
+    BOX_WIDTH,
+    BOX_HEIGHT,
+    CORR_WIDTH,
+    OBSTACLE_WIDTH,
+    OBSTACLE_HEIGHT,
+    BIG_OBSTACLE_W,
+    BIG_OBSTACLE_H,
+    EXIT_WIDTH,
+    EXIT_HEIGHT,
+    EXITS,
+    AGENT_RADIUS,
+    AGENT_COUNT,
+    CLOCK_BOX_WIDTH,
+)
+
+
+def rescale(value:int, scaling:int) -> int:
+    """Rescales a length given at `SCALING` in constants.py to `scaling`."""
+    return value * SCALING // scaling
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    Immutable geometry and crowd parameters of one evacuation run.
+
+    A scenario is passed to `Simulation`, which hands it on to every `Agent` and to the subgoal
+    logic, so runs with different halls can share one interpreter. Derived data (Obstacle objects,
+    obstacle arrays, subgoal zones, spawn positions) is built on first use and cached on the instance.
+
+    Attributes:
+        scaling (int): Factor the hall was scaled down by, relative to the original pixel layout.
+        width, height (int): Size of the window.
+        box_left, box_top, box_width, box_height (int): The walls of the hall.
+        agent_radius (int): Radius of an agent.
+        agent_count (int): Number of agents that are spawned.
+        exit_width (int): Width of every exit.
+        exits (tuple): Exit dicts with 'position', 'width' and 'height', as in `constants.EXITS`.
+        benches (tuple): (left, top, width, height) of the obstacles agents steer around.
+        desks (tuple): (left, top, width, height) of the obstacles agents are pushed out of.
+        seat_blocks (tuple): Dicts with 'left', 'top', 'dx', 'dy', 'columns' and 'rows' of a seat grid.
+        subgoal_zones (tuple): Zone dicts per subgoal stage, as in `constants.SUBGOAL_ZONES`.
+        base_zone (dict): Zone that marks agents that were pushed back between the benches.
+        navigation (str): 'subgoals' to pass the subgoal zones first, 'flow_field' to follow the
+            shortest path around the obstacles to the nearest exit (see `navigation.FlowField`).
+    """
+    scaling: int
+    width: int
+    height: int
+    box_left: int
+    box_top: int
+    box_width: int
+    box_height: int
+    agent_radius: int
+    agent_count: int
+    exit_width: int
+    exits: tuple
+    benches: tuple
+    desks: tuple
+    seat_blocks: tuple
+    subgoal_zones: tuple
+    base_zone: dict
+    navigation: str = "subgoals"
+
+    @classmethod
+    def lecture_hall(cls, scaling:int=SCALING, agent_count:int=AGENT_COUNT, doors:int=len(EXITS), exit_width:int=None) -> "Scenario":
+        """
+        Builds the lecture hall of `constants.py`: 15 bench columns, the teacher desk and one or two doors.
+
+        Parameters:
+            scaling (int): Factor the original pixel layout is scaled down by.
+            agent_count (int): Number of agents seated behind the benches.
+            doors (int): 1 for a single door in the top wall, 2 to add the door opposite of it.
+            exit_width (int): Width of the doors, defaults to `EXIT_WIDTH` rescaled to `scaling`.
+
+        Returns:
+            Scenario: The lecture hall.
+        """
+        if doors not in (1, 2):
+            raise ValueError(f"Invalid number of doors: {doors}. Must be 1 or 2.")
+
+        # All lengths in constants.py are given at SCALING, rescale them to the requested scaling
+        def scaled(value):
+            return rescale(value, scaling)
+
+        width, height = scaled(WIDTH), scaled(HEIGHT)
+        box_width, box_height = scaled(BOX_WIDTH), scaled(BOX_HEIGHT)
+        box_left = (width - box_width) // 2
+        box_top = (height - box_height) // 2
+        corr_width = scaled(CORR_WIDTH)
+        obstacle_width = scaled(OBSTACLE_WIDTH)
+        obstacle_height = scaled(OBSTACLE_HEIGHT)
+        radius = scaled(AGENT_RADIUS)
+        if exit_width is None:
+            exit_width = scaled(EXIT_WIDTH)
+
+        exit_left = box_left + scaled(1700 // SCALING)
+        exits = [{"position": (exit_left, box_top - EXIT_HEIGHT), "width": exit_width, "height": EXIT_HEIGHT}]
+        if doors == 2:
+            exits.append({"position": (exit_left, box_top + box_height), "width": exit_width, "height": EXIT_HEIGHT})
+
+        benches = tuple((box_left + scaled(75) + i * obstacle_width * 2, box_top + corr_width, obstacle_width, obstacle_height)
+                        for i in range(15))
+        desks = ((box_left + scaled(1790 // SCALING), box_top + corr_width + scaled(55 // SCALING),
+                  scaled(BIG_OBSTACLE_W), scaled(BIG_OBSTACLE_H)),)
+
+        # Agents start behind the desks
+        seat_blocks = ({"left": box_left + scaled(75) - radius, "top": box_top + corr_width + radius + scaled(5),
+                        "dx": obstacle_width * 2, "dy": radius * 3, "columns": 15, "rows": 16},)
+
+        benches_width = obstacle_width * 29
+        subgoal_zones = (
+            (
+                {"left": box_left, "top": box_top, "width": benches_width + scaled(175), "height": corr_width, "color": (0, 255, 0)},
+                {"left": box_left, "top": box_top + corr_width + obstacle_height, "width": benches_width + scaled(175), "height": corr_width, "color": (0, 255, 0)},
+            ),
+            (
+                # The pre-goal-zone is wide as the whole classroom
+                {"left": box_left + benches_width + scaled(75), "top": box_top, "width": box_width - (benches_width + scaled(75)), "height": box_height, "color": (0, 0, 255)},
+            ),
+        )
+        base_zone = {"left": box_left, "top": box_top + corr_width, "width": benches_width + scaled(75), "height": obstacle_height, "color": (255, 0, 0)}
+
+        return cls(scaling=scaling, width=width, height=height,
+                   box_left=box_left, box_top=box_top, box_width=box_width, box_height=box_height,
+                   agent_radius=radius, agent_count=agent_count, exit_width=exit_width,
+                   exits=tuple(exits), benches=benches, desks=desks, seat_blocks=seat_blocks,
+                   subgoal_zones=subgoal_zones, base_zone=base_zone)
+
+    def fingerprint(self) -> str:
+        """Returns a hash of all parameters, equal for scenarios that describe the same hall and crowd."""
+        parameters = json.dumps({name: getattr(self, name) for name in self.__dataclass_fields__}, sort_keys=True)
+        return hashlib.sha256(parameters.encode()).hexdigest()
+
+    def __getstate__(self) -> dict:
+        # Only pickle the parameters, derived data is rebuilt on first use in the receiving process
+        return {name: self.__dict__[name] for name in self.__dataclass_fields__}
+
+    @property
+    def env_length(self) -> int:
+        """Normalization length of the distance to the exit in the panic model."""
+        return max(self.box_width, self.box_height)
+
+    @property
+    def subgoal_n(self) -> int:
+        """Number of subgoal stages an agent passes before heading to the nearest exit."""
+        return len(self.subgoal_zones)
+
+    @property
+    def clock_box_left(self) -> int:
+        # Right Box border + half of free space on the right side of the screen
+        return (self.box_left + self.box_width) + int((self.box_left - CLOCK_BOX_WIDTH) / 2)
+
+    @property
+    def clock_box_top(self) -> int:
+        return self.box_top
+
+    @cached_property
+    def obstacles(self) -> list:
+        """Obstacle objects of all benches and desks."""
+        return [Obstacle(*rect) for rect in self.benches + self.desks]
+
+    @cached_property
+    def desk_obstacles(self) -> list:
+        """Obstacle objects of the desks, which agents are not allowed to enter."""
+        return self.obstacles[len(self.benches):]
+
+    @cached_property
+    def obstacle_array(self) -> np.ndarray:
+        """(n, 4) array with left, top, width and height of all obstacles."""
+        return np.array(self.benches + self.desks, dtype=float).reshape(-1, 4)
+
+    @cached_property
+    def subgoal_obstacles(self) -> list:
+        """Obstacle objects of the subgoal zones, one list per stage."""
+        return [[Obstacle(**zone) for zone in zones] for zones in self.subgoal_zones]
+
+    @cached_property
+    def base_zone_obstacle(self) -> Obstacle:
+        return Obstacle(**self.base_zone)
+
+    @cached_property
+    def exit_targets(self) -> list:
+        """Centers of the exits, which agents steer to after their last subgoal."""
+        return [pygame.Vector2(e["position"][0] + e["width"] / 2, e["position"][1] + e["height"] / 2) for e in self.exits]
+
+    @cached_property
+    def exit_reference_points(self) -> list:
+        """Points that `Agent.calculate_exit_distances` measures the distance to the exits from."""
+        return [pygame.Vector2(e["position"][0] - e["width"] // 2, e["position"][1] - e["height"] // 2) for e in self.exits]
+
+    @cached_property
+    def exit_spans(self) -> list:
+        """(wall, low, high) of every exit: the wall it is in and the stretch of that wall it covers."""
+        spans = []
+        for e in self.exits:
+            x, y = e["position"]
+            if y + e["height"] <= self.box_top:
+                spans.append(("top", x, x + e["width"]))
+            elif y >= self.box_top + self.box_height:
+                spans.append(("bottom", x, x + e["width"]))
+            elif x + e["width"] <= self.box_left:
+                spans.append(("left", y, y + e["height"]))
+            else:
+                spans.append(("right", y, y + e["height"]))
+        return spans
+
+    def is_in_exit_area(self, x:float, y:float, margin:float) -> bool:
+        """
+        Checks if a position is within margin of a wall, in front of an exit in that wall.
+
+        Parameters:
+            x, y (float): The position to check.
+            margin (float): Distance from the wall that still counts as in front of the exit.
+        """
+        for wall, low, high in self.exit_spans:
+            if wall == "top" or wall == "bottom":
+                along = x
+                at_wall = y < self.box_top + margin if wall == "top" else y > self.box_top + self.box_height - margin
+            else:
+                along = y
+                at_wall = x < self.box_left + margin if wall == "left" else x > self.box_left + self.box_width - margin
+            if at_wall and low <= along <= high:
+                return True
+        return False
+
+    def exit_index(self, positions:np.ndarray, epsilon:float) -> np.ndarray:
+        """
+        Finds the exit every position has passed through.
+
+        Parameters:
+            positions (np.ndarray): (n, 2) array of positions.
+            epsilon (float): Distance before the wall at which an agent already counts as escaped.
+
+        Returns:
+            np.ndarray: Index into `exits` per position, -1 for positions that did not pass an exit.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        x, y = positions[:, 0], positions[:, 1]
+        index = np.full(len(positions), -1)
+        for exit_id, (wall, low, high) in enumerate(self.exit_spans):
+            if wall == "top":
+                through, along = y <= self.box_top + epsilon, x
+            elif wall == "bottom":
+                through, along = y >= self.box_top + self.box_height - epsilon, x
+            elif wall == "left":
+                through, along = x <= self.box_left + epsilon, y
+            else:
+                through, along = x >= self.box_left + self.box_width - epsilon, y
+            index[(index < 0) & through & (low <= along) & (along <= high)] = exit_id
+        return index
+
+    def escaped_mask(self, positions:np.ndarray, epsilon:float) -> np.ndarray:
+        """
+        Checks which positions have passed through an exit.
+
+        Parameters:
+            positions (np.ndarray): (n, 2) array of positions.
+            epsilon (float): Distance before the wall at which an agent already counts as escaped.
+
+        Returns:
+            np.ndarray: Boolean mask of the escaped positions.
+        """
+        return self.exit_index(positions, epsilon) >= 0
+
+    def exit_measurement_boxes(self, depth:float=None) -> list:
+        """
+        Returns a (left, top, width, height) box in front of every exit, inside the hall.
+
+        Parameters:
+            depth (float): Distance the boxes reach into the hall, defaults to the exit width.
+        """
+        if depth is None:
+            depth = self.exit_width
+        boxes = []
+        for wall, low, high in self.exit_spans:
+            if wall == "top":
+                boxes.append((low, self.box_top, high - low, depth))
+            elif wall == "bottom":
+                boxes.append((low, self.box_top + self.box_height - depth, high - low, depth))
+            elif wall == "left":
+                boxes.append((self.box_left, low, depth, high - low))
+            else:
+                boxes.append((self.box_left + self.box_width - depth, low, depth, high - low))
+        return boxes
+
+    @cached_property
+    def flow_field(self):
+        """Shortest-path navigation field to the exits, see `navigation.FlowField`."""
+        from navigation import FlowField
+        return FlowField.from_scenario(self)
+
+    @cached_property
+    def seat_positions(self) -> np.ndarray:
+        """(n, 2) array of all seats, row by row and block by block."""
+        seats = []
+        for block in self.seat_blocks:
+            rows, columns = np.divmod(np.arange(block["rows"] * block["columns"]), block["columns"])
+            seats.append(np.column_stack((block["left"] + columns * block["dx"], block["top"] + rows * block["dy"])))
+        return np.concatenate(seats).astype(float)
+
+    @cached_property
+    def spawn_positions(self) -> np.ndarray:
+        """(agent_count, 2) array of starting positions, seats are reused if there are more agents than seats."""
+        return np.resize(self.seat_positions, (self.agent_count, 2))
+
+
+DEFAULT_SCENARIO = Scenario.lecture_hall()
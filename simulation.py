@@ -1,54 +1,91 @@
 import numpy as np
 import pygame
-import math
+import random
+import time
+from collections import defaultdict
 from metrics import Metrics
 import csv
 from agent import Agent
-from obstacle import Obstacle
-from constants import (EXITS,
-                       WIDTH, HEIGHT,
-                       BOX_LEFT,
-                       BOX_HEIGHT,
-                       BOX_TOP,
-                       BOX_WIDTH,
-                       BOX_COLOR,
-                       AGENT_RADIUS,
+from neighborhood import Neighborhood
+from decomposition import StripPool
+from continuum import Continuum
+from telemetry import TelemetryPublisher, TELEMETRY_EVERY
+from scenario import Scenario, DEFAULT_SCENARIO
+from constants import (BOX_COLOR,
                        AGENT_AVG_SPEED,
                        EXIT_COLOR,
                        BLACK,
-                       AGENT_COUNT,
                        CLOCK_BOX_WIDTH,
                        CLOCK_BOX_HEIGHT,
-                       CLOCK_BOX_LEFT,
-                       CLOCK_BOX_TOP,
-                       OBSTACLE_WIDTH,
-                       OBSTACLE_HEIGHT,
-                       CORR_WIDTH,
-                       BIG_OBSTACLE_H,
-                       BIG_OBSTACLE_W,
                        CSV_FILE_NAME,
                        COLUMN_NAMES,
-                       SCALING, 
-                       SUBGOAL_ZONES,
                        VISUALIZE_SUBGOALS,
-                       BASE_ZONE, 
                        AGENT_SPEED_SIGMA,
                        RENDER,
                        SEPARATION_THRESHOLD
                        )
 
 
+def common_random_numbers(seed:int, agent_count:int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Draws the initial velocity and the speed quantile of every agent from a generator of their own,
+    so replica seed of every parameter combination starts from the same random numbers.
+
+    Parameters:
+        seed (int): Seed of the replica.
+        agent_count (int): Number of agents.
+
+    Returns:
+        tuple: (agent_count, 2) initial velocities in [-1, 1) and agent_count speed quantiles in [0, 1).
+    """
+    generator = np.random.default_rng(seed)
+    return generator.uniform(-1, 1, (agent_count, 2)), generator.random(agent_count)
+
+
 class Simulation:
-    def __init__(self, run_name=CSV_FILE_NAME, show_plots=True):
-        self.total_agents = AGENT_COUNT
+    def __init__(self, run_name=CSV_FILE_NAME, show_plots=True, scenario:Scenario=DEFAULT_SCENARIO, render=RENDER, heatmap_bins=None, streaming_metrics=False, save_results=True, strips=None, level_of_detail=False, topological_k=None,
+                 telemetry=None, telemetry_every=TELEMETRY_EVERY):
+        '''
+        heatmap_bins enables the congestion heatmap of Metrics, with (x, y) cells over the box of the scenario.
+        streaming_metrics keeps running panic statistics instead of every panic level of every agent.
+        save_results writes the metrics to runs/ and the summary to data/ after the run, sweeps that
+        collect the returned results themselves turn it off.
+        strips steps the agents in that many worker processes, each owning a strip of the hall (see
+        decomposition.py), self.neighborhood is then not built.
+        level_of_detail moves the agents in dense cells as a continuum instead of one by one (see continuum.py).
+        topological_k lets every agent interact with its topological_k nearest neighbors only, instead of
+        with all neighbors within its radii.
+        telemetry publishes a record of the run every telemetry_every ticks to a file, Unix socket or
+        localhost port (see telemetry.py).
+        '''
+        self.scenario = scenario
+        self.render = render
+        self.total_agents = scenario.agent_count
         self.frame_counter = 0
-        self.metrics = Metrics(AGENT_COUNT, run_name=run_name)
+        heatmap_bounds = None
+        if heatmap_bins is not None:
+            heatmap_bounds = (scenario.box_left, scenario.box_top, scenario.box_width, scenario.box_height)
+        self.metrics = Metrics(scenario.agent_count, run_name=run_name, heatmap_bounds=heatmap_bounds, heatmap_bins=heatmap_bins,
+                               exit_boxes=scenario.exit_measurement_boxes(), streaming=streaming_metrics)
         self.run_name = run_name
         self.show_plots = show_plots
+        self.save_results = save_results
+        self.strips = strips
+        self.level_of_detail = level_of_detail
+        self.topological_k = topological_k
+        self.telemetry = telemetry
+        self.telemetry_every = telemetry_every
+        # Agents held by the continuum of the level-of-detail mode
+        self.continuum = None
+        self.ticks = 0
+        # Neighborhood of the last tick, kept for analysis like panic-cluster detection
+        self.neighborhood = None
+        # Accumulated wall-clock seconds per stage of a tick
+        self.stage_times = defaultdict(float)
 
     def resolve_positions(self, positions, radius, box_width, box_height, box_left, box_top, obstacles, agents):
         '''
-        Ensures that agents don't overlap with the teacher desk and stay within the box
+        Ensures that agents don't overlap with the desks in obstacles and stay within the box
         '''
 
         positions = np.array(positions)
@@ -59,39 +96,28 @@ class Simulation:
             x, y = positions[i]
 
             # Determine if the agent is near any exit
-            in_exit_area = False
-            for exit in EXITS:
-                exit_x, exit_y = exit["position"]
-                exit_width = exit["width"]
-
-                # If the exit is on the top or bottom, check if the agent is near it
-                if ((y < box_top + radius and exit_y <= box_top + radius) or
-                    (y > box_top + box_height - radius and exit_y >= box_top + box_height - radius)) and (
-                        exit_x <= x <= exit_x + exit_width):
-                    in_exit_area = True
-                    break
+            in_exit_area = self.scenario.is_in_exit_area(x, y, radius)
 
             if not in_exit_area:
                 # Boundary checks if not in the exit area
                 x = max(box_left + radius, min(x, box_left + box_width - radius))
                 y = max(box_top + radius, min(y, box_top + box_height - radius))
 
-                # Obstacle collision detection for the big obstacle
+                # Obstacle collision detection for the desks
                 for obstacle in obstacles:
-                    if obstacle.width == BIG_OBSTACLE_W and obstacle.height == BIG_OBSTACLE_H:
-                        if (obstacle.left - radius <= x <= obstacle.left + obstacle.width + radius) and (
-                                obstacle.top - radius <= y <= obstacle.top + obstacle.height + radius):
-                            # Adjust x position if in an Obstacle
-                            if x < obstacle.left:
-                                x = obstacle.left - radius
-                            elif x > obstacle.left + obstacle.width:
-                                x = obstacle.left + obstacle.width + radius
-
-                            # Adjust y position if in an Obstacle
-                            if y < obstacle.top:
-                                y = obstacle.top - radius
-                            elif y > obstacle.top + obstacle.height:
-                                y = obstacle.top + obstacle.height + radius
+                    if (obstacle.left - radius <= x <= obstacle.left + obstacle.width + radius) and (
+                            obstacle.top - radius <= y <= obstacle.top + obstacle.height + radius):
+                        # Adjust x position if in an Obstacle
+                        if x < obstacle.left:
+                            x = obstacle.left - radius
+                        elif x > obstacle.left + obstacle.width:
+                            x = obstacle.left + obstacle.width + radius
+
+                        # Adjust y position if in an Obstacle
+                        if y < obstacle.top:
+                            y = obstacle.top - radius
+                        elif y > obstacle.top + obstacle.height:
+                            y = obstacle.top + obstacle.height + radius
 
             # resolve_positions is not allowed to make an arbitrary size displacement to the agents
             old_pos = positions[i]
@@ -105,192 +131,241 @@ class Simulation:
         
         return positions.tolist()
 
-    def record_distances(self, agents):
+    def build_neighborhood(self, agents):
         '''
-        Records distances of other agents within every agent's perception so they don't
-        have to be recaluculated when trying to execute the boids behaviours
+        Builds the neighborhood relation of all agents within perception once per tick, so
+        the boids behaviours of every agent can be read from its sparse matrices
         '''
+        perception = max((agent.perception for agent in agents), default=0)
+        return Neighborhood(agents, perception, self.topological_k)
 
-        count = len(agents)
-        for i in range(count):
-            # Empty distances, in the case one agent is out via the exit.
-            agents[i].distances = np.full(AGENT_COUNT, fill_value=-1)
 
-        for i in range(count):
-            for j in range(i + 1, count):
-                agent_x = agents[i].position.x
-                agent_y = agents[i].position.y
-                other_x = agents[j].position.x
-                other_y = agents[j].position.y
-                # If too far, don't calculate norm
-                if abs(agent_x - other_x) > agents[i].perception or abs(agent_y - other_y) > agents[i].perception:
-                    continue
-                distance = math.dist((agent_x, agent_y), (other_x, other_y))
-
-                agents[i].distances[agents[j].id] = distance
-                agents[j].distances[agents[i].id] = distance
+    def main_loop(self, avg_speed=AGENT_AVG_SPEED, sigma=AGENT_SPEED_SIGMA, sep_threshold=SEPARATION_THRESHOLD, max_ticks=None, seed=None):
+        '''
+        Runs the evacuation until every agent escaped, or for at most max_ticks ticks.
+        The wall-clock time spent in every stage of a tick is accumulated in self.stage_times.
+        If seed is given, the random generators are seeded with it first and the agents start from
+        the common random numbers of the seed, whatever avg_speed, sigma and sep_threshold are.
 
+        Returns a dict with the values of COLUMN_NAMES, and the ticks to exit ('agent_ticks')
+        and the average panic level ('agent_panic') of every agent.
+        '''
+        if seed is not None:
+            np.random.seed(seed)
+            random.seed(seed)
+        scenario = self.scenario
+        box_left, box_top = scenario.box_left, scenario.box_top
+        box_width, box_height = scenario.box_width, scenario.box_height
+        exits = scenario.exits
+        stage_times = self.stage_times
 
-    def main_loop(self, avg_speed=AGENT_AVG_SPEED, sigma=AGENT_SPEED_SIGMA, sep_threshold=SEPARATION_THRESHOLD):
-        
         # Initialize Pygame
-        if RENDER:
+        if self.render:
             pygame.init()
-            screen = pygame.display.set_mode((WIDTH, HEIGHT))
+            screen = pygame.display.set_mode((scenario.width, scenario.height))
             clock = pygame.time.Clock()
             start_ticks = pygame.time.get_ticks()
 
         # Agents start behind the desks
-        starting_positions = []
-        space_between_starting_agents = ((OBSTACLE_HEIGHT / 16) - AGENT_RADIUS * 2)
-        for i in range(AGENT_COUNT // 15):
-            row = i % 16
-            for j in range(15):
-                col = j
-                starting_positions.append((BOX_LEFT + 75 - AGENT_RADIUS + col * (AGENT_RADIUS + OBSTACLE_WIDTH*2 - AGENT_RADIUS), BOX_TOP + CORR_WIDTH + AGENT_RADIUS + 5 + (row)* AGENT_RADIUS*3))
-
-        agents = [Agent(x, y, id, avg_speed, sigma) for (id, (x, y)) in enumerate(starting_positions)]
+        spawn_positions = scenario.spawn_positions.tolist()
+        if seed is None:
+            agents = [Agent(x, y, id, avg_speed, sigma, scenario) for (id, (x, y)) in enumerate(spawn_positions)]
+        else:
+            velocities, speed_quantiles = common_random_numbers(seed, len(spawn_positions))
+            velocities, speed_quantiles = velocities.tolist(), speed_quantiles.tolist()
+            agents = [Agent(x, y, id, avg_speed, sigma, scenario, velocities[id], speed_quantiles[id])
+                      for (id, (x, y)) in enumerate(spawn_positions)]
+        obstacles = scenario.obstacles
+        pool = None
+        self.continuum = Continuum(scenario) if self.level_of_detail else None
+        publisher = None
+        if self.telemetry is not None:
+            publisher = TelemetryPublisher(self.telemetry)
+            exit_escapes = np.zeros(len(exits), dtype=int)
+            last_publish = (0, time.perf_counter())
+        try:
+            if self.strips is not None and self.strips > 1:
+                pool = StripPool(scenario, self.strips, sep_threshold, max((agent.perception for agent in agents), default=0),
+                                 self.topological_k)
         
-        # Main loop
-        running = True
-        paused = False
-        while running:
-            # Pause block
-            if RENDER:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        running = False
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_SPACE:
-                            paused = not paused
-                if paused:
-                    continue
-
-                screen.fill(BLACK)
+            # Main loop
+            running = True
+            paused = False
+            tick = 0
+            while running:
+                # Pause block
+                if self.render:
+                    for event in pygame.event.get():
+                        if event.type == pygame.QUIT:
+                            running = False
+                        if event.type == pygame.KEYDOWN:
+                            if event.key == pygame.K_SPACE:
+                                paused = not paused
+                    if paused:
+                        continue
+
+                    screen.fill(BLACK)
                 
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        running = False
+                    for event in pygame.event.get():
+                        if event.type == pygame.QUIT:
+                            running = False
             
-                # Box
-                pygame.draw.rect(screen, BOX_COLOR, (BOX_LEFT, BOX_TOP, BOX_WIDTH, BOX_HEIGHT), 1)
+                    # Box
+                    pygame.draw.rect(screen, BOX_COLOR, (box_left, box_top, box_width, box_height), 1)
                 
-                # Draw all exits
-                for exit in EXITS:
-                    pygame.draw.rect(screen, EXIT_COLOR, (*exit["position"], exit["width"], exit['height']))
-
-                # Clock
-                pygame.draw.rect(screen, BOX_COLOR, (CLOCK_BOX_LEFT, CLOCK_BOX_TOP, CLOCK_BOX_WIDTH, CLOCK_BOX_HEIGHT), 1)
-
-                # zones for subgoal finding
-                if VISUALIZE_SUBGOALS:
-                    for subgoals_dicts in SUBGOAL_ZONES.values():
-                        subgoals = [Obstacle(**p) for p in subgoals_dicts]
-                        for subgoal in subgoals:
-                            subgoal.draw(screen)
-                    base_zone = Obstacle(**BASE_ZONE)
-                    base_zone.draw(screen)
-            
-            # Obstacles
-            obstacles = []
-            for i in range(15):
-                obstacles.append(Obstacle(BOX_LEFT + 75 + (i) * OBSTACLE_WIDTH * 2, BOX_TOP + CORR_WIDTH, OBSTACLE_WIDTH, OBSTACLE_HEIGHT))
-            obstacles.append(Obstacle(BOX_LEFT + ((1250+450+90) // SCALING), BOX_TOP + CORR_WIDTH + (55//SCALING), BIG_OBSTACLE_W, BIG_OBSTACLE_H))
-            
-            if RENDER:
-                for obstacle in obstacles:
-                    obstacle.draw(screen)
-
-            # Epsilon for escape-easing
-            epsilon = 2
-
-            dropped_out_agents = [
-                agent for agent in agents
-                if any(
-                    (agent.position.y >= BOX_TOP + BOX_HEIGHT - epsilon and
-                     exit["position"][0] <= agent.position.x <= exit["position"][0] + exit["width"])
-                    or
-                    (agent.position.y <= BOX_TOP + epsilon and
-                     exit["position"][0] <= agent.position.x <= exit["position"][0] + exit["width"])
-                    for exit in EXITS
-                )
-            ]
-
-            self.metrics.record_agent_escape(dropped_out_agents)
-
-            # Update and draw agents, only keep agents that have not exited yet
-            agents = [
-                agent for agent in agents
-                if not any(
-                    (agent.position.y >= BOX_TOP + BOX_HEIGHT - epsilon and
-                     exit["position"][0] <= agent.position.x <= exit["position"][0] + exit["width"])
-                    or
-                    (agent.position.y <= BOX_TOP + epsilon and
-                     exit["position"][0] <= agent.position.x <= exit["position"][0] + exit["width"])
-                    for exit in EXITS
-                )
-            ]
-
-            # Exit if no more agents
-            if agents == []:
-                running = False
-
-            np_agents = np.array(agents, dtype=object)
-            self.record_distances(np_agents)
-
-            # Update positions of the agents
-            for agent in agents:
-                agent.flock(np_agents, obstacles, sep_threshold)
-                agent.update()
-
-            # Update all active Agents time-steps
-            self.metrics.increment_tick()
-            # Update panic levels in the Metrics class (for all active Agents)
-            self.metrics.update_panic_levels(agents)
-            # Resolve any overlaps or boundary issues
-            positions = [(agent.position.x, agent.position.y) for agent in agents]
-            resolved_positions = self.resolve_positions(positions, AGENT_RADIUS, BOX_WIDTH, BOX_HEIGHT, BOX_LEFT, BOX_TOP, obstacles, agents)
-            # Update boid positions after resolving
-            for i, agent in enumerate(agents):
-                agent.position.x, agent.position.y = resolved_positions[i]
-
-            # Draw all agents
-            if RENDER:
-                for agent in agents:
-                    agent.draw(screen)
-
-                # Clock update
-                elapsed_time_sec = (pygame.time.get_ticks()-start_ticks)/1000
-                time_text = pygame.font.Font(None, 26).render(f"Time: {elapsed_time_sec:.2f}", True, (255, 255, 255))
-                screen.blit(time_text, (CLOCK_BOX_LEFT+5, CLOCK_BOX_TOP+8))
-                self.frame_counter += 1
-                time_text = pygame.font.Font(None, 26).render(f"Frames: {self.frame_counter}", True, (255, 255, 255))
-                screen.blit(time_text, (CLOCK_BOX_LEFT+5, CLOCK_BOX_TOP+32))
-
-                pygame.display.flip()
-
-
-                clock.tick(60)
-        if RENDER:
+                    # Draw all exits
+                    for exit in exits:
+                        pygame.draw.rect(screen, EXIT_COLOR, (*exit["position"], exit["width"], exit['height']))
+
+                    # Clock
+                    pygame.draw.rect(screen, BOX_COLOR, (scenario.clock_box_left, scenario.clock_box_top, CLOCK_BOX_WIDTH, CLOCK_BOX_HEIGHT), 1)
+
+                    # zones for subgoal finding
+                    if VISUALIZE_SUBGOALS:
+                        for subgoals in scenario.subgoal_obstacles:
+                            for subgoal in subgoals:
+                                subgoal.draw(screen)
+                        scenario.base_zone_obstacle.draw(screen)
+
+                    for obstacle in obstacles:
+                        obstacle.draw(screen)
+
+                # Epsilon for escape-easing
+                epsilon = 2
+
+                stage_start = time.perf_counter()
+                exit_ids = scenario.exit_index([(agent.position.x, agent.position.y) for agent in agents], epsilon)
+                escaped = exit_ids >= 0
+                dropped_out_agents = [agent for agent, out in zip(agents, escaped) if out]
+
+                self.metrics.record_agent_escape(dropped_out_agents)
+                if publisher is not None:
+                    exit_escapes += np.bincount(exit_ids[escaped], minlength=len(exits))
+
+                # Update and draw agents, only keep agents that have not exited yet
+                agents = [agent for agent, out in zip(agents, escaped) if not out]
+                stage_times["escape"] += time.perf_counter() - stage_start
+
+                # Dense crowds move as a continuum, the agents left are simulated one by one
+                coarse_agents = []
+                if self.continuum is not None:
+                    stage_start = time.perf_counter()
+                    agents = self.continuum.step(agents)
+                    coarse_agents = self.continuum.agents()
+                    stage_times["continuum"] += time.perf_counter() - stage_start
+
+                # Exit if no more agents
+                if agents == [] and coarse_agents == []:
+                    running = False
+
+                if pool is None:
+                    stage_start = time.perf_counter()
+                    self.neighborhood = self.build_neighborhood(agents)
+                    start_positions = self.neighborhood.positions
+                    stage_times["neighborhood"] += time.perf_counter() - stage_start
+
+                    # Update positions of the agents
+                    stage_start = time.perf_counter()
+                    for agent in agents:
+                        agent.flock(self.neighborhood, obstacles, sep_threshold)
+                        agent.update()
+                    stage_times["flock"] += time.perf_counter() - stage_start
+                else:
+                    # The strip workers build the neighborhoods of their agents and flock them in parallel
+                    stage_start = time.perf_counter()
+                    start_positions = np.array([(agent.position.x, agent.position.y) for agent in agents], dtype=float).reshape(-1, 2)
+                    pool.step(agents)
+                    stage_times["flock"] += time.perf_counter() - stage_start
+
+                # Update all active Agents time-steps
+                stage_start = time.perf_counter()
+                self.metrics.increment_tick()
+                # Update panic levels in the Metrics class (for all active Agents)
+                self.metrics.update_panic_levels(agents + coarse_agents)
+                self.metrics.update_heatmap(agents + coarse_agents)
+                stage_times["metrics"] += time.perf_counter() - stage_start
+
+                # Resolve any overlaps or boundary issues
+                stage_start = time.perf_counter()
+                positions = [(agent.position.x, agent.position.y) for agent in agents]
+                resolved_positions = self.resolve_positions(positions, scenario.agent_radius, box_width, box_height, box_left, box_top, scenario.desk_obstacles, agents)
+                # Update boid positions after resolving
+                for i, agent in enumerate(agents):
+                    agent.position.x, agent.position.y = resolved_positions[i]
+                stage_times["resolve"] += time.perf_counter() - stage_start
+
+                # Flow through the exits, with the speed measured as the distance moved this tick
+                stage_start = time.perf_counter()
+                resolved_positions = np.array(resolved_positions, dtype=float).reshape(-1, 2)
+                speeds = np.linalg.norm(resolved_positions - start_positions, axis=1)
+                self.metrics.record_exit_flow(exit_ids[escaped], resolved_positions, speeds)
+                stage_times["metrics"] += time.perf_counter() - stage_start
+
+                tick += 1
+                if max_ticks is not None and tick >= max_ticks:
+                    running = False
+
+                if publisher is not None and (tick % self.telemetry_every == 0 or not running):
+                    now = time.perf_counter()
+                    panic = [agent.panic for agent in agents] + [agent.panic for agent in coarse_agents]
+                    publisher.publish({"run": self.run_name, "tick": tick, "agents": len(panic),
+                                       "escapes_per_exit": exit_escapes.tolist(),
+                                       "mean_panic": float(np.mean(panic)) if panic else 0.0,
+                                       "max_panic": float(np.max(panic)) if panic else 0.0,
+                                       "ticks_per_second": (tick - last_publish[0]) / max(now - last_publish[1], 1e-9),
+                                       "dropped": publisher.dropped})
+                    last_publish = (tick, now)
+
+                # Draw all agents
+                if self.render:
+                    for agent in agents + coarse_agents:
+                        agent.draw(screen)
+
+                    # Clock update
+                    elapsed_time_sec = (pygame.time.get_ticks()-start_ticks)/1000
+                    time_text = pygame.font.Font(None, 26).render(f"Time: {elapsed_time_sec:.2f}", True, (255, 255, 255))
+                    screen.blit(time_text, (scenario.clock_box_left+5, scenario.clock_box_top+8))
+                    self.frame_counter += 1
+                    time_text = pygame.font.Font(None, 26).render(f"Frames: {self.frame_counter}", True, (255, 255, 255))
+                    screen.blit(time_text, (scenario.clock_box_left+5, scenario.clock_box_top+32))
+
+                    pygame.display.flip()
+
+
+                    clock.tick(60)
+        finally:
+            # Stop the strip workers and the telemetry thread also when the run raises
+            if pool is not None:
+                pool.close()
+            if publisher is not None:
+                publisher.close()
+        if self.render:
             pygame.quit()
-        avg_panics = []
-        for panic in self.metrics.agent_panic:
-            avg_panics.append(np.mean(panic))
-        mean_panic = np.mean(avg_panics)
+        self.ticks = tick
+        mean_panic = np.mean(self.metrics.mean_panic_per_agent())
         mean_ticks = np.mean(self.metrics.agent_ticks)
         print(f"Separation threshold: {sep_threshold}, Avg speed: {avg_speed}, Sigma: {sigma}, avg evac time: {mean_ticks}, avg panic: {mean_panic}")
-        self.metrics.show_tick_distribution()
-        self.metrics.show_mean_panic_distribution()
-        self.metrics.plot_average_panic_over_time()
-        self.metrics.save_metrics()
-
-
+        if self.show_plots:
+            self.metrics.show_tick_distribution()
+            self.metrics.show_mean_panic_distribution()
+            self.metrics.plot_average_panic_over_time()
+            self.metrics.exit_flow.plot(name=f'exit_flow{self.run_name[:-4]}')
+            if self.metrics.heatmap is not None:
+                self.metrics.heatmap.plot(name=f'heatmap{self.run_name[:-4]}')
         data = [[sep_threshold, avg_speed, sigma, mean_ticks, mean_panic]]
-        # Writing to CSV
-        with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(COLUMN_NAMES)
-            for row in data:                
-                writer.writerow(row)
-
-        print(f"Data written to {CSV_FILE_NAME}")
\ No newline at end of file
+        if self.save_results:
+            self.metrics.save_metrics()
+
+            # Writing to CSV
+            with open("data/" + CSV_FILE_NAME, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(COLUMN_NAMES)
+                for row in data:                
+                    writer.writerow(row)
+
+            print(f"Data written to {CSV_FILE_NAME}")
+
+        result = dict(zip(COLUMN_NAMES, [float(value) for value in data[0]]))
+        result["agent_ticks"] = list(self.metrics.agent_ticks)
+        result["agent_panic"] = self.metrics.calculate_average_panic()
+        return result
\ No newline at end of file
@@ -1,23 +1,23 @@
-from constants import SUBGOAL_ZONES, AGENT_RADIUS, WIDTH, HEIGHT, BASE_ZONE
-from obstacle import Obstacle
+from scenario import Scenario, DEFAULT_SCENARIO
 import pygame
 
 # A zone counts as entered after being obstacle_padding pixels deep
 obstacle_padding = 3
 
-def find_subgoal(subgoal_indicator:int, agent_location:pygame.Vector2) -> tuple[pygame.Vector2, bool]:
+def find_subgoal(subgoal_indicator:int, agent_location:pygame.Vector2, scenario:Scenario=DEFAULT_SCENARIO) -> tuple[pygame.Vector2, bool]:
     """
     Calculates the direction to the nearest subgoal zone based on the agent's current location and target subgoal ID.
     
     Parameters:
-        subgoal_indicator (int): The ID of the target subgoal zone, as defined in `SUBGOAL_ZONES`.
+        subgoal_indicator (int): The ID of the target subgoal zone, as defined in `scenario.subgoal_zones`.
         agent_location (pygame.Vector2): The current position of the agent.
+        scenario (Scenario): The scenario the zones are taken from.
         
     Returns:
         tuple: A `pygame.Vector2` position for the nearest subgoal, and a boolean indicating whether the agent is in the subgoal zone.
     """
-    subgoals_dicts = SUBGOAL_ZONES[subgoal_indicator]
-    subgoals = [Obstacle(**p) for p in subgoals_dicts]
+    subgoals = scenario.subgoal_obstacles[subgoal_indicator]
+    agent_radius = scenario.agent_radius
 
     # Calculate smallest distance to subgoal-zones and pick zone
     min_distance = float('inf')
@@ -25,14 +25,14 @@ def find_subgoal(subgoal_indicator:int, agent_location:pygame.Vector2) -> tuple[
 
     for subgoal in subgoals:
         subgoal_position = pygame.Vector2((subgoal.left + subgoal.width//2), (subgoal.top + subgoal.height//2))
-        x_in = (subgoal.left < agent_location.x-AGENT_RADIUS-obstacle_padding) and ((subgoal.left + subgoal.width) >= agent_location.x+AGENT_RADIUS+obstacle_padding)
-        y_in = (subgoal.top < agent_location.y-AGENT_RADIUS-obstacle_padding) and ((subgoal.top + subgoal.height) >= agent_location.y+AGENT_RADIUS+obstacle_padding)
+        x_in = (subgoal.left < agent_location.x-agent_radius-obstacle_padding) and ((subgoal.left + subgoal.width) >= agent_location.x+agent_radius+obstacle_padding)
+        y_in = (subgoal.top < agent_location.y-agent_radius-obstacle_padding) and ((subgoal.top + subgoal.height) >= agent_location.y+agent_radius+obstacle_padding)
         if x_in and y_in:
             return subgoal_position, True
         
         
-        if am_i_stuck(agent_location, subgoal_indicator):
-            subgoal_target, _ = find_subgoal(subgoal_indicator-1, agent_location)
+        if am_i_stuck(agent_location, subgoal_indicator, scenario):
+            subgoal_target, _ = find_subgoal(subgoal_indicator-1, agent_location, scenario)
         else:
             if x_in:
                 subgoal_target = pygame.Vector2(agent_location.x, subgoal_position.y)
@@ -49,7 +49,7 @@ def find_subgoal(subgoal_indicator:int, agent_location:pygame.Vector2) -> tuple[
     return target, False
 
 
-def am_i_stuck(agent_location:pygame.Vector2, zone_id:int) -> bool:
+def am_i_stuck(agent_location:pygame.Vector2, zone_id:int, scenario:Scenario=DEFAULT_SCENARIO) -> bool:
     """
     Checks if an agent is stuck, particularly if it has been pushed back into obstacles (like benches).
     Updates the subgoal if the agent is stuck.
@@ -57,13 +57,15 @@ def am_i_stuck(agent_location:pygame.Vector2, zone_id:int) -> bool:
     Parameters:
         agent_location (pygame.Vector2): The current position of the agent.
         zone_id (int): The ID of the target zone to determine if the agent is stuck.
+        scenario (Scenario): The scenario the base zone is taken from.
     
     Returns:
         bool: True if the agent is determined to be stuck and should adjust its subgoal, False otherwise.
     """
-    base_zone = Obstacle(**BASE_ZONE)
+    base_zone = scenario.base_zone_obstacle
+    offset = scenario.agent_radius + obstacle_padding
     if not zone_id:
         return False
-    if base_zone.is_in(pygame.Vector2(agent_location.x, agent_location.y+AGENT_RADIUS+obstacle_padding)) or base_zone.is_in(pygame.Vector2(agent_location.x, agent_location.y-AGENT_RADIUS-obstacle_padding)):
+    if base_zone.is_in(pygame.Vector2(agent_location.x, agent_location.y+offset)) or base_zone.is_in(pygame.Vector2(agent_location.x, agent_location.y-offset)):
         return True
-    return False
\ No newline at end of file
+    return False
@@ -0,0 +1,265 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from scipy import stats
+from simulation import Simulation
+from runcache import cached_run
+from scenario import Scenario, DEFAULT_SCENARIO
+from constants import COLUMN_NAMES
+
+# Outcomes whose confidence intervals decide when a parameter combination has enough runs
+SWEEP_METRICS = ("avg_evac_time", "avg_panic")
+
+
+def replicate(avg_speed:float, sigma:float, sep_threshold:float, scenario:Scenario, seed:int,
+               max_ticks:int, use_cache:bool) -> dict:
+    """Runs one headless replication in a worker process and returns its row of `COLUMN_NAMES`."""
+    kwargs = dict(show_plots=False, render=False, streaming_metrics=True, save_results=False)
+    if use_cache:
+        result = cached_run(avg_speed, sigma, sep_threshold, scenario=scenario, seed=seed, max_ticks=max_ticks, **kwargs)
+    else:
+        simulation = Simulation(scenario=scenario, **kwargs)
+        result = simulation.main_loop(avg_speed, sigma, sep_threshold, max_ticks=max_ticks, seed=seed)
+    return {column: result[column] for column in COLUMN_NAMES}
+
+
+class Replications:
+    """Finished and running replications of one parameter combination."""
+    def __init__(self, avg_speed:float, sigma:float, sep_threshold:float) -> None:
+        self.avg_speed = avg_speed
+        self.sigma = sigma
+        self.sep_threshold = sep_threshold
+        self.results = {}
+        self.pending = 0
+        self.next_seed = 0
+
+    @property
+    def runs(self) -> int:
+        return len(self.results)
+
+    def values(self, metric:str) -> np.ndarray:
+        return np.array([self.results[seed][metric] for seed in sorted(self.results)], dtype=float)
+
+    def half_width(self, metric:str, confidence:float) -> float:
+        """Half-width of the Student t confidence interval of the mean of metric, inf below two runs."""
+        if self.runs < 2:
+            return math.inf
+        values = self.values(metric)
+        return stats.t.ppf((1 + confidence) / 2, self.runs - 1) * values.std(ddof=1) / math.sqrt(self.runs)
+
+    def relative_half_width(self, metric:str, confidence:float) -> float:
+        """Half-width relative to the mean, so evacuation times and panic levels compare."""
+        half_width = self.half_width(metric, confidence)
+        if math.isinf(half_width):
+            return half_width
+        mean = abs(self.values(metric).mean())
+        if mean == 0:
+            return 0.0 if half_width == 0 else math.inf
+        return half_width / mean
+
+
+class AdaptiveSweep:
+    """
+    Replicates every parameter combination until the confidence intervals of its mean evacuation time
+    and mean panic are narrow enough, or until it used up its budget of runs.
+
+    Every combination first gets min_runs replications. After that a free worker goes to the unfinished
+    combination whose interval is the widest relative to its mean, taking into account the runs it
+    already has in flight, so low-variance combinations stop early and the budget goes to noisy ones.
+    The k-th replication of a combination is seeded with k, runs are therefore reproducible and read
+    from the run cache when they were done before.
+    """
+    def __init__(self, combinations:list, scenario:Scenario=DEFAULT_SCENARIO, min_runs:int=3, batch_size:int=2,
+                 max_runs:int=30, rel_precision:float=0.02, confidence:float=0.95, workers:int=None,
+                 max_ticks:int=None, use_cache:bool=True) -> None:
+        """
+        Parameters:
+            combinations (list): (avg_speed, sigma, sep_threshold) per parameter combination.
+            scenario (Scenario): The hall and crowd.
+            min_runs (int): Replications of every combination before its precision is judged, at least 2.
+            batch_size (int): Replications a combination is given at once.
+            max_runs (int): Budget of replications per combination.
+            rel_precision (float): Target half-width of the confidence intervals, relative to the mean.
+            confidence (float): Confidence level of the intervals.
+            workers (int): Number of worker processes, defaults to the number of CPUs.
+            max_ticks (int): Maximal number of ticks of a run.
+            use_cache (bool): Read and store the runs in the run cache.
+        """
+        if min_runs < 2:
+            raise ValueError(f"Invalid min_runs: {min_runs}. A confidence interval needs at least 2 runs.")
+        if max_runs < min_runs:
+            raise ValueError(f"Invalid max_runs: {max_runs}. Must be at least min_runs ({min_runs}).")
+        self.combinations = [Replications(*combination) for combination in combinations]
+        self.scenario = scenario
+        self.min_runs = min_runs
+        self.batch_size = batch_size
+        self.max_runs = max_runs
+        self.rel_precision = rel_precision
+        self.confidence = confidence
+        self.workers = workers or os.cpu_count()
+        self.max_ticks = max_ticks
+        self.use_cache = use_cache
+
+    def converged(self, combination:Replications) -> bool:
+        """Whether the intervals of all `SWEEP_METRICS` of combination reached the target precision."""
+        return combination.runs >= self.min_runs and all(
+            combination.relative_half_width(metric, self.confidence) <= self.rel_precision for metric in SWEEP_METRICS)
+
+    def finished(self, combination:Replications) -> bool:
+        return combination.runs >= self.max_runs or self.converged(combination)
+
+    def _priority(self, combination:Replications) -> float:
+        """
+        Expected relative half-width once the runs in flight are done, the interval shrinks with the square root of the runs.
+        """
+        width = max(combination.relative_half_width(metric, self.confidence) for metric in SWEEP_METRICS)
+        if math.isinf(width):
+            return width
+        return width * math.sqrt(combination.runs / (combination.runs + combination.pending))
+
+    def _next_combination(self) -> Replications:
+        """Returns the combination the next batch goes to, or None if none needs more runs."""
+        candidates = [c for c in self.combinations
+                      if not self.finished(c) and c.runs + c.pending < self.max_runs]
+        starting = [c for c in candidates if c.runs + c.pending < self.min_runs]
+        if starting:
+            return min(starting, key=lambda c: c.runs + c.pending)
+        # Combinations below min_runs are still running their first replications
+        candidates = [c for c in candidates if c.runs >= self.min_runs]
+        if not candidates:
+            return None
+        return max(candidates, key=self._priority)
+
+    def run(self) -> list:
+        """
+        Runs the sweep.
+
+        Returns:
+            list: A dict per combination with its parameters, number of runs, means and confidence
+                interval half-widths of `SWEEP_METRICS`, and whether it converged.
+        """
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = {}
+            while True:
+                while len(futures) < self.workers:
+                    combination = self._next_combination()
+                    if combination is None:
+                        break
+                    budget = self.max_runs - combination.runs - combination.pending
+                    for _ in range(min(self.batch_size, budget, self.workers - len(futures))):
+                        future = executor.submit(replicate, combination.avg_speed, combination.sigma,
+                                                 combination.sep_threshold, self.scenario, combination.next_seed,
+                                                 self.max_ticks, self.use_cache)
+                        futures[future] = (combination, combination.next_seed)
+                        combination.next_seed += 1
+                        combination.pending += 1
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    combination, seed = futures.pop(future)
+                    combination.pending -= 1
+                    combination.results[seed] = future.result()
+                    if combination.pending == 0 and self.finished(combination):
+                        print(f"Avg speed: {combination.avg_speed}, Sigma: {combination.sigma}, "
+                              f"Separation threshold: {combination.sep_threshold} done after {combination.runs} runs")
+        return self.summary()
+
+    def summary(self) -> list:
+        """Returns the statistics of every combination, see `run`."""
+        summaries = []
+        for combination in self.combinations:
+            summary = {"avg_speed": combination.avg_speed, "sigma": combination.sigma,
+                       "sep_threshold": combination.sep_threshold, "runs": combination.runs,
+                       "converged": self.converged(combination)}
+            for metric in SWEEP_METRICS:
+                values = combination.values(metric)
+                summary[metric] = float(values.mean()) if len(values) else math.nan
+                summary[f"{metric}_half_width"] = float(combination.half_width(metric, self.confidence))
+            summaries.append(summary)
+        return summaries
+
+    def rows(self) -> list:
+        """Returns a row of `COLUMN_NAMES` per finished run, ordered by combination and seed."""
+        return [[combination.results[seed][column] for column in COLUMN_NAMES]
+                for combination in self.combinations for seed in sorted(combination.results)]
+
+
+class Study:
+    """
+    Runs every point of a design with the same replicas. Replica k of every point is seeded with k and
+    therefore starts from the same common random numbers (see `common_random_numbers` in
+    `simulation.py`), so differences between points are estimated on paired runs.
+    """
+    def __init__(self, points:list, replicas:int=5, scenario:Scenario=DEFAULT_SCENARIO, workers:int=None,
+                 max_ticks:int=None, use_cache:bool=True) -> None:
+        """
+        Parameters:
+            points (list): (avg_speed, sigma, sep_threshold) per point, see `design.py`.
+            replicas (int): Runs of every point.
+            scenario (Scenario): The hall and crowd.
+            workers (int): Number of worker processes, defaults to the number of CPUs.
+            max_ticks (int): Maximal number of ticks of a run.
+            use_cache (bool): Read and store the runs in the run cache.
+        """
+        self.combinations = [Replications(*point) for point in points]
+        self.replicas = replicas
+        self.scenario = scenario
+        self.workers = workers or os.cpu_count()
+        self.max_ticks = max_ticks
+        self.use_cache = use_cache
+
+    def run(self) -> "Study":
+        """Runs the replicas that are missing and returns the study."""
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = {}
+            for combination in self.combinations:
+                for seed in range(self.replicas):
+                    if seed not in combination.results:
+                        future = executor.submit(replicate, combination.avg_speed, combination.sigma,
+                                                 combination.sep_threshold, self.scenario, seed,
+                                                 self.max_ticks, self.use_cache)
+                        futures[future] = (combination, seed)
+            for future in futures:
+                combination, seed = futures[future]
+                combination.results[seed] = future.result()
+        return self
+
+    def _combination(self, point:tuple) -> Replications:
+        for combination in self.combinations:
+            if (combination.avg_speed, combination.sigma, combination.sep_threshold) == tuple(point):
+                return combination
+        raise ValueError(f"Invalid point: {point}. It is not part of the study.")
+
+    def paired_difference(self, point:tuple, baseline:tuple, metric:str="avg_evac_time",
+                          confidence:float=0.95) -> tuple[float, float]:
+        """
+        Estimates the mean difference of metric between two points from the replicas they share.
+
+        Parameters:
+            point (tuple): (avg_speed, sigma, sep_threshold) of the point.
+            baseline (tuple): (avg_speed, sigma, sep_threshold) it is compared to.
+            metric (str): One of `COLUMN_NAMES`.
+            confidence (float): Confidence level of the interval.
+
+        Returns:
+            tuple: Mean of metric at point minus at baseline, and the half-width of its confidence interval.
+        """
+        a, b = self._combination(point), self._combination(baseline)
+        seeds = sorted(set(a.results) & set(b.results))
+        differences = np.array([a.results[seed][metric] - b.results[seed][metric] for seed in seeds], dtype=float)
+        if len(differences) < 2:
+            return float(differences.mean()) if len(differences) else math.nan, math.inf
+        half_width = stats.t.ppf((1 + confidence) / 2, len(differences) - 1) * differences.std(ddof=1) / math.sqrt(len(differences))
+        return float(differences.mean()), float(half_width)
+
+    def points(self) -> list:
+        """Returns the (avg_speed, sigma, sep_threshold) point of every run, in the order of `rows`."""
+        return [(combination.avg_speed, combination.sigma, combination.sep_threshold)
+                for combination in self.combinations for _ in combination.results]
+
+    def rows(self) -> list:
+        """Returns a row of `COLUMN_NAMES` per run, ordered by point and seed."""
+        return [[combination.results[seed][column] for column in COLUMN_NAMES]
+                for combination in self.combinations for seed in sorted(combination.results)]
@@ -0,0 +1,124 @@
+import json
+import queue
+import socket
+import threading
+import time
+
+TELEMETRY_EVERY = 10
+TELEMETRY_QUEUE_SIZE = 256
+# Seconds before a sink that could not be reached is tried again
+RECONNECT_DELAY = 1.0
+
+
+class TelemetryPublisher:
+    """
+    Publishes records of a running simulation to a local sink, one JSON object per line.
+
+    The sink is a path to a newline-delimited JSON file, 'unix:<path>' for a Unix socket, or
+    'tcp:<port>' for a port on localhost. Records are written by a background thread; the simulation
+    only puts them into a bounded queue, and when the queue is full because the sink is too slow the
+    record is dropped instead of slowing down the simulation. Records that could not be delivered
+    are counted in self.dropped.
+    """
+    def __init__(self, sink:str, queue_size:int=TELEMETRY_QUEUE_SIZE) -> None:
+        """
+        Parameters:
+            sink (str): Where to publish, see above.
+            queue_size (int): Number of records waiting for the sink before new ones are dropped.
+        """
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        # Records are dropped on the simulation thread and on the publisher thread
+        self._dropped_lock = threading.Lock()
+        self._file = None
+        self._connection = None
+        self._retry_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def publish(self, record:dict) -> bool:
+        """Queues a record without blocking, returns False if it was dropped."""
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self._drop()
+            return False
+
+    def _drop(self) -> None:
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def close(self, timeout:float=5.0) -> None:
+        """Delivers the queued records, waiting at most timeout seconds, and closes the sink."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    return
+                self._write((json.dumps(record) + "\n").encode())
+        finally:
+            if self._file is not None:
+                self._file.close()
+            if self._connection is not None:
+                self._connection.close()
+
+    def _write(self, line:bytes) -> None:
+        if not (self.sink.startswith("unix:") or self.sink.startswith("tcp:")):
+            if self._file is None:
+                if time.monotonic() < self._retry_at:
+                    self._drop()
+                    return
+                try:
+                    self._file = open(self.sink, 'ab')
+                except OSError:
+                    self._retry_at = time.monotonic() + RECONNECT_DELAY
+                    self._drop()
+                    return
+            try:
+                self._file.write(line)
+                self._file.flush()
+            except OSError:
+                # E.g. a full disk, reopen the file with the next record
+                file, self._file = self._file, None
+                try:
+                    file.close()
+                except OSError:
+                    pass
+                self._drop()
+            return
+        if self._connection is None:
+            if time.monotonic() < self._retry_at:
+                self._drop()
+                return
+            try:
+                self._connection = self._connect()
+            except OSError:
+                self._retry_at = time.monotonic() + RECONNECT_DELAY
+                self._drop()
+                return
+        try:
+            self._connection.sendall(line)
+        except OSError:
+            # The listener went away, reconnect with the next record
+            self._connection.close()
+            self._connection = None
+            self._drop()
+
+    def _connect(self) -> socket.socket:
+        kind, address = self.sink.split(":", 1)
+        if kind == "unix":
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(address)
+            return connection
+        return socket.create_connection(("127.0.0.1", int(address)))
@@ -0,0 +1,137 @@
+import math
+from scenario import Scenario, rescale
+from constants import (
+    SCALING,
+    WIDTH,
+    BOX_WIDTH,
+    CORR_WIDTH,
+    OBSTACLE_WIDTH,
+    BIG_OBSTACLE_W,
+    EXIT_WIDTH,
+    EXIT_HEIGHT,
+    AGENT_RADIUS,
+)
+
+VENUE_KINDS = ("lecture_hall", "auditorium")
+WALLS = ("top", "bottom", "left", "right")
+
+# Benches and seats of one block, the lecture hall of constants.py is a single such block
+BENCHES_PER_BLOCK = 15
+SEATS_PER_BENCH = 16
+
+
+def generate_venue(kind:str="lecture_hall", blocks:tuple=(1, 1), benches_per_block:int=BENCHES_PER_BLOCK,
+                   seats_per_bench:int=SEATS_PER_BENCH, exits:list=None, exit_width:int=None,
+                   agent_count:int=None, scaling:int=SCALING) -> Scenario:
+    """
+    Generates a venue of blocks of benches, separated by aisles, with a front area holding the desk.
+
+    In a lecture hall the benches run from the top to the bottom wall like in `constants.py` and the
+    front is on the right. An auditorium is the same layout turned by 90 degrees: rows of benches
+    facing a stage at the bottom. Agents navigate with a flow field, so the exits may be in any wall.
+
+    Parameters:
+        kind (str): 'lecture_hall' or 'auditorium'.
+        blocks (tuple): Number of blocks across and along the benches.
+        benches_per_block (int): Benches in every block.
+        seats_per_bench (int): Seats behind every bench.
+        exits (list): (wall, fraction) per exit, with wall one of 'top', 'bottom', 'left' or 'right'
+            and fraction the position of the exit center along that wall, from 0 to 1.
+        exit_width (int): Width of the exits, defaults to `EXIT_WIDTH` rescaled to `scaling`.
+        agent_count (int): Number of agents, defaults to one per seat.
+        scaling (int): Factor the original pixel layout is scaled down by.
+
+    Returns:
+        Scenario: The generated venue.
+    """
+    if kind not in VENUE_KINDS:
+        raise ValueError(f"Invalid venue kind: {kind}. Must be one of {VENUE_KINDS}.")
+    if exits is None:
+        # Doors next to the front area
+        exits = [("top", 0.9), ("bottom", 0.9)] if kind == "lecture_hall" else [("left", 0.9), ("right", 0.9)]
+    if exit_width is None:
+        exit_width = rescale(EXIT_WIDTH, scaling)
+
+    radius = rescale(AGENT_RADIUS, scaling)
+    corr_width = rescale(CORR_WIDTH, scaling)
+    bench_width = rescale(OBSTACLE_WIDTH, scaling)
+    bench_pitch = 2 * bench_width
+    seat_pitch = 3 * radius
+    bench_length = seats_per_bench * seat_pitch + rescale(5, scaling)
+    desk_width = rescale(BIG_OBSTACLE_W, scaling)
+    margin = rescale((WIDTH - BOX_WIDTH) // 2, scaling)
+
+    # The layout is built for a lecture hall, u running across and v along the benches
+    blocks_u, blocks_v = blocks
+    block_u = benches_per_block * bench_pitch
+    seats_u = corr_width + blocks_u * (block_u + corr_width)
+    box_u = seats_u + 2 * corr_width + desk_width
+    box_v = corr_width + blocks_v * (bench_length + corr_width)
+
+    benches = []
+    seat_blocks = []
+    for i in range(blocks_u):
+        for j in range(blocks_v):
+            block_left = corr_width + i * (block_u + corr_width)
+            block_top = corr_width + j * (bench_length + corr_width)
+            for k in range(benches_per_block):
+                benches.append((block_left + bench_pitch - bench_width + k * bench_pitch, block_top, bench_width, bench_length))
+            seat_blocks.append({"left": block_left + bench_pitch - bench_width - radius, "top": block_top + radius + rescale(5, scaling),
+                                "dx": bench_pitch, "dy": seat_pitch, "columns": benches_per_block, "rows": seats_per_bench})
+    desk_length = max(box_v - 4 * corr_width, box_v // 2)
+    desks = [(seats_u + corr_width, (box_v - desk_length) // 2, desk_width, desk_length)]
+
+    if kind == "auditorium":
+        box_u, box_v = box_v, box_u
+        benches = [(top, left, height, width) for (left, top, width, height) in benches]
+        desks = [(top, left, height, width) for (left, top, width, height) in desks]
+        seat_blocks = [{"left": b["top"], "top": b["left"], "dx": b["dy"], "dy": b["dx"], "columns": b["rows"], "rows": b["columns"]}
+                       for b in seat_blocks]
+
+    # Move everything into the box
+    box_left, box_top = margin, margin
+    benches = tuple((box_left + left, box_top + top, width, height) for (left, top, width, height) in benches)
+    desks = tuple((box_left + left, box_top + top, width, height) for (left, top, width, height) in desks)
+    seat_blocks = tuple(dict(b, left=box_left + b["left"], top=box_top + b["top"]) for b in seat_blocks)
+
+    exit_dicts = []
+    for wall, fraction in exits:
+        if wall not in WALLS:
+            raise ValueError(f"Invalid wall: {wall}. Must be one of {WALLS}.")
+        if wall == "top" or wall == "bottom":
+            left = box_left + min(max(int(fraction * box_u) - exit_width // 2, 0), box_u - exit_width)
+            top = box_top - EXIT_HEIGHT if wall == "top" else box_top + box_v
+            exit_dicts.append({"position": (left, top), "width": exit_width, "height": EXIT_HEIGHT})
+        else:
+            top = box_top + min(max(int(fraction * box_v) - exit_width // 2, 0), box_v - exit_width)
+            left = box_left - EXIT_HEIGHT if wall == "left" else box_left + box_u
+            exit_dicts.append({"position": (left, top), "width": EXIT_HEIGHT, "height": exit_width})
+
+    seats = sum(b["columns"] * b["rows"] for b in seat_blocks)
+    if agent_count is None:
+        agent_count = seats
+    elif agent_count > seats:
+        raise ValueError(f"Invalid agent_count: {agent_count}. The venue only has {seats} seats.")
+
+    return Scenario(scaling=scaling, width=box_u + 2 * margin, height=box_v + 2 * margin,
+                    box_left=box_left, box_top=box_top, box_width=box_u, box_height=box_v,
+                    agent_radius=radius, agent_count=agent_count, exit_width=exit_width,
+                    exits=tuple(exit_dicts), benches=benches, desks=desks, seat_blocks=seat_blocks,
+                    subgoal_zones=(), base_zone=None, navigation="flow_field")
+
+
+def venue_for(agent_count:int, kind:str="lecture_hall", **kwargs) -> Scenario:
+    """
+    Generates the smallest roughly square venue with a seat for each of agent_count agents.
+
+    Parameters:
+        agent_count (int): Number of agents.
+        kind (str): 'lecture_hall' or 'auditorium'.
+        kwargs: Further arguments for `generate_venue`.
+    """
+    benches_per_block = kwargs.get("benches_per_block", BENCHES_PER_BLOCK)
+    seats_per_bench = kwargs.get("seats_per_bench", SEATS_PER_BENCH)
+    n_blocks = math.ceil(agent_count / (benches_per_block * seats_per_bench))
+    blocks_u = math.ceil(math.sqrt(n_blocks))
+    blocks_v = math.ceil(n_blocks / blocks_u)
+    return generate_venue(kind, blocks=(blocks_u, blocks_v), agent_count=agent_count, **kwargs)
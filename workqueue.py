@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+from multiprocessing import Process
+from runcache import run_key
+from scenario import Scenario, DEFAULT_SCENARIO
+from sweep import replicate
+
+QUEUE_DIRECTORY = "cache/queue"
+# Seconds between two heartbeats of a worker, and after which a claim without heartbeat is taken back
+HEARTBEAT = 10
+LEASE = 60
+POLL = 2
+
+
+def _write_atomically(path:str, data:bytes) -> None:
+    """Writes data to a temporary file and renames it to path, so readers never see half a file."""
+    temporary_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+    os.replace(temporary_path, path)
+
+
+class WorkQueue:
+    """
+    Queue of runs in a directory that every node can reach, e.g. on a network file system.
+
+    Every run is a work item named after its `run_key` and moves through the subdirectories
+        pending/<key>.json: waiting for a worker,
+        claimed/<key>.json: claimed by a worker, renamed from pending/ so only one worker gets it,
+        results/<key>.json: the result, written by a rename as well,
+        failed/<key>.json: the item and error of a run that raised, so it is not retried forever.
+    A worker touches its claim every `HEARTBEAT` seconds. Claims that were not touched for `lease` seconds
+    belong to dead workers and are moved back to pending/. A run that is done twice because its worker was
+    only slow gives the same result under the same name, so writing it again does no harm.
+    """
+    def __init__(self, directory:str=QUEUE_DIRECTORY, lease:float=LEASE) -> None:
+        """
+        Parameters:
+            directory (str): Shared directory of the queue.
+            lease (float): Seconds without heartbeat after which a claim is taken back.
+        """
+        self.directory = directory
+        self.lease = lease
+        for name in ("pending", "claimed", "results", "failed", "scenarios"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _path(self, state:str, key:str) -> str:
+        return os.path.join(self.directory, state, f"{key}.json")
+
+    def _keys(self, state:str) -> list:
+        return sorted(name[:-len(".json")] for name in os.listdir(os.path.join(self.directory, state))
+                      if name.endswith(".json"))
+
+    def submit(self, combinations:list, replicas:int=1, scenario:Scenario=DEFAULT_SCENARIO, max_ticks:int=None) -> list:
+        """
+        Queues every combination with the seeds 0 to replicas - 1. Runs that are queued or done already are skipped,
+        runs that failed before are queued again.
+
+        Parameters:
+            combinations (list): (avg_speed, sigma, sep_threshold) per parameter combination.
+            replicas (int): Runs per combination.
+            scenario (Scenario): The hall and crowd.
+            max_ticks (int): Maximal number of ticks of a run.
+
+        Returns:
+            list: Keys of all runs, in the order of the combinations and seeds.
+        """
+        scenario_path = os.path.join(self.directory, "scenarios", f"{scenario.fingerprint()}.pickle")
+        if not os.path.exists(scenario_path):
+            _write_atomically(scenario_path, pickle.dumps(scenario))
+        keys = []
+        for avg_speed, sigma, sep_threshold in combinations:
+            for seed in range(replicas):
+                key = run_key(avg_speed, sigma, sep_threshold, scenario, seed, max_ticks)
+                keys.append(key)
+                if any(os.path.exists(self._path(state, key)) for state in ("pending", "claimed", "results")):
+                    continue
+                try:
+                    os.remove(self._path("failed", key))
+                except FileNotFoundError:
+                    pass
+                item = {"avg_speed": avg_speed, "sigma": sigma, "sep_threshold": sep_threshold, "seed": seed,
+                        "max_ticks": max_ticks, "scenario": scenario.fingerprint()}
+                _write_atomically(self._path("pending", key), json.dumps(item).encode())
+        return keys
+
+    def claim(self, worker:str) -> tuple[str, dict]:
+        """
+        Claims a pending run for worker.
+
+        Returns:
+            tuple: Key and item of the run, or (None, None) if no run is pending.
+        """
+        for key in self._keys("pending"):
+            try:
+                # The rename keeps the modification time, the lease has to start before the claim shows up
+                os.utime(self._path("pending", key))
+                os.rename(self._path("pending", key), self._path("claimed", key))
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            path = self._path("claimed", key)
+            if not self.heartbeat(key):
+                # Taken back by another node in the meantime
+                continue
+            try:
+                with open(path) as file:
+                    item = json.load(file)
+            except FileNotFoundError:
+                continue
+            item["worker"] = worker
+            _write_atomically(path, json.dumps(item).encode())
+            return key, item
+        return None, None
+
+    def heartbeat(self, key:str) -> bool:
+        """Renews the claim of a run, returns False if it was taken back in the meantime."""
+        try:
+            os.utime(self._path("claimed", key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, key:str, result:dict) -> None:
+        """Stores the result of a run and releases its claim."""
+        _write_atomically(self._path("results", key), json.dumps(result).encode())
+        try:
+            os.remove(self._path("claimed", key))
+        except FileNotFoundError:
+            pass
+
+    def fail(self, key:str, item:dict, error:Exception) -> None:
+        """Records that a run raised error and releases its claim."""
+        _write_atomically(self._path("failed", key), json.dumps({**item, "error": repr(error)}).encode())
+        try:
+            os.remove(self._path("claimed", key))
+        except FileNotFoundError:
+            pass
+
+    def reclaim(self) -> list:
+        """Moves the claims of dead workers back to pending/ and returns their keys."""
+        reclaimed = []
+        now = time.time()
+        for key in self._keys("claimed"):
+            path = self._path("claimed", key)
+            try:
+                if now - os.stat(path).st_mtime <= self.lease:
+                    continue
+                if os.path.exists(self._path("results", key)):
+                    os.remove(path)
+                else:
+                    os.rename(path, self._path("pending", key))
+                    reclaimed.append(key)
+            except FileNotFoundError:
+                # The worker finished or another node reclaimed it first
+                continue
+        return reclaimed
+
+    def scenario(self, fingerprint:str) -> Scenario:
+        with open(os.path.join(self.directory, "scenarios", f"{fingerprint}.pickle"), 'rb') as file:
+            return pickle.load(file)
+
+    def result(self, key:str) -> dict:
+        """Returns the result of a run, or None if it is not done yet."""
+        try:
+            with open(self._path("results", key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def failure(self, key:str) -> dict:
+        """Returns the item and error of a failed run, or None if it did not fail."""
+        try:
+            with open(self._path("failed", key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def progress(self) -> dict:
+        """Number of pending, claimed, finished and failed runs."""
+        return {state: len(self._keys(state)) for state in ("pending", "claimed", "results", "failed")}
+
+    def wait(self, keys:list, poll:float=POLL) -> list:
+        """
+        Waits until all runs of keys are done or failed, taking back the claims of dead workers meanwhile.
+
+        Returns:
+            list: The results in the order of keys.
+
+        Raises:
+            RuntimeError: If any of the runs failed.
+        """
+        while True:
+            self.reclaim()
+            results = [self.result(key) for key in keys]
+            failures = [self.failure(key) for key, result in zip(keys, results) if result is None]
+            if all(failure is not None for failure in failures):
+                if failures:
+                    raise RuntimeError(f"{len(failures)} of {len(keys)} runs failed, the first with {failures[0]['error']}.")
+                return results
+            time.sleep(poll)
+
+
+def run_worker(directory:str=QUEUE_DIRECTORY, lease:float=LEASE, heartbeat:float=HEARTBEAT,
+               poll:float=POLL, exit_when_idle:bool=True, use_cache:bool=False) -> int:
+    """
+    Claims and runs the runs of a queue headless until it is empty. Runs that raise are recorded as failed.
+
+    Parameters:
+        directory (str): Shared directory of the queue.
+        lease (float): Seconds without heartbeat after which a claim is taken back.
+        heartbeat (float): Seconds between two renewals of the claim of the current run.
+        poll (float): Seconds to wait when no run is pending.
+        exit_when_idle (bool): Return once no run is pending or claimed, otherwise wait for new runs.
+        use_cache (bool): Also read and store the runs in the run cache of this node.
+
+    Returns:
+        int: Number of runs done by this worker.
+    """
+    queue = WorkQueue(directory, lease)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    done = 0
+    while True:
+        queue.reclaim()
+        key, item = queue.claim(worker)
+        if key is None:
+            if exit_when_idle and not queue.progress()["claimed"]:
+                return done
+            time.sleep(poll)
+            continue
+
+        stop = threading.Event()
+        def renew():
+            while not stop.wait(heartbeat):
+                queue.heartbeat(key)
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            result = replicate(item["avg_speed"], item["sigma"], item["sep_threshold"], queue.scenario(item["scenario"]),
+                               item["seed"], item["max_ticks"], use_cache)
+        except Exception as error:
+            queue.fail(key, item, error)
+            continue
+        finally:
+            stop.set()
+            renewer.join()
+        queue.complete(key, result)
+        done += 1
+
+
+def start_local_workers(n:int, directory:str=QUEUE_DIRECTORY, **kwargs) -> list:
+    """
+    Starts n worker processes on this machine, standing in for the nodes of a cluster.
+
+    Returns:
+        list: The started processes.
+    """
+    workers = [Process(target=run_worker, args=(directory,), kwargs=kwargs) for _ in range(n)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the runs of a shared work queue.")
+    parser.add_argument("directory", nargs="?", default=QUEUE_DIRECTORY, help="Shared directory of the queue.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes on this node.")
+    parser.add_argument("--lease", type=float, default=LEASE, help="Seconds after which a claim without heartbeat is taken back.")
+    parser.add_argument("--wait", action="store_true", help="Keep waiting for new runs when the queue is empty.")
+    arguments = parser.parse_args()
+    for process in start_local_workers(arguments.workers, arguments.directory, lease=arguments.lease,
+                                       exit_when_idle=not arguments.wait):
+        process.join()